@@ -0,0 +1,86 @@
+"""Compare the table driven packet codec with the original byte loops.
+
+Run from the repository root with ``python benchmarks/codec.py``.
+"""
+
+import timeit
+
+from common import core
+
+encryption = core("encryption")
+
+NUMBER = 100_000
+
+
+def legacy_encrypt(source: bytearray) -> bytearray:
+    """Encrypt like the original implementation did."""
+    secret = (len(source) + 1) ^ 0x54
+    encoded = bytearray([0x54, secret, 0x5A])
+    for b in source:
+        encoded.append(b ^ 0xE)
+    return encoded
+
+
+def legacy_decrypt(source: bytearray) -> bytearray:
+    """Decrypt like the original implementation did."""
+    key = source[0] ^ source[2]
+    decrypted = bytearray()
+    for i in range(3, len(source)):
+        decrypted.append(source[i] ^ key)
+    return decrypted
+
+
+def legacy_add_crc(source: bytearray) -> bytearray:
+    """Append the checksum like the original implementation did."""
+    crc = 0x0
+    for b in source:
+        crc = b ^ crc
+    source.append(crc)
+    return source
+
+
+def main() -> None:
+    """Run the benchmark and print the speedup per operation."""
+    payload = bytearray(range(16))
+    chunk = encryption.encrypt(encryption.add_crc(payload))
+    assert legacy_encrypt(legacy_add_crc(bytearray(payload))) == chunk
+    assert legacy_decrypt(chunk) == encryption.decrypt(chunk)
+
+    target = bytearray(64)
+    batch = [chunk] * 32
+    cases = [
+        (
+            "encrypt",
+            lambda: legacy_encrypt(payload),
+            lambda: encryption.encrypt(payload),
+        ),
+        ("decrypt", lambda: legacy_decrypt(chunk), lambda: encryption.decrypt(chunk)),
+        (
+            "decrypt_into",
+            lambda: legacy_decrypt(chunk),
+            lambda: encryption.decrypt_into(chunk, target),
+        ),
+        (
+            "add_crc",
+            lambda: legacy_add_crc(bytearray(payload)),
+            lambda: encryption.add_crc(payload),
+        ),
+        (
+            "decrypt_many(32)",
+            lambda: [legacy_decrypt(c) for c in batch],
+            lambda: encryption.decrypt_many(batch),
+        ),
+    ]
+
+    print(f"{'operation':<18}{'legacy us':>12}{'table us':>12}{'speedup':>10}")
+    for name, legacy, table in cases:
+        legacy_time = timeit.timeit(legacy, number=NUMBER) / NUMBER * 1e6
+        table_time = timeit.timeit(table, number=NUMBER) / NUMBER * 1e6
+        print(
+            f"{name:<18}{legacy_time:>12.3f}{table_time:>12.3f}"
+            f"{legacy_time / table_time:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""Helpers shared by the benchmarks."""
+
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from standalone import core  # noqa: E402
+
+__all__ = ["core"]
@@ -0,0 +1,99 @@
+"""Replay a packet capture through the client and device of the integration.
+
+The recorded notification chunks are fed to Client.notify_callback of a
+device that never connects, at the recorded speed or as fast as possible.
+Captures without chunks replay their decrypted frames instead:
+
+    python benchmarks/replay.py fluvalble_capture.cap --speed 0
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from bleak import BLEDevice
+from common import core
+
+capture = core("capture")
+device_module = core("device")
+policy = core("policy")
+
+
+async def replay(records: list, speed: float, frames: bool) -> dict:
+    """Feed the records to a device and return what it decoded."""
+    device = device_module.Device(
+        "replay",
+        BLEDevice("00:00:00:00:00:00", "replay", {}),
+        None,
+        policy.ConnectionPolicy(policy.MODE_ON_DEMAND),
+    )
+    client = device.client
+    kind = capture.KIND_FRAME if frames else capture.KIND_CHUNK
+    selected = [(timestamp, data) for timestamp, k, data in records if k == kind]
+
+    first = selected[0][0] if selected else 0.0
+    start = time.perf_counter()
+    for timestamp, data in selected:
+        if speed > 0:
+            delay = (timestamp - first) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if frames:
+            device.decode_update_packet(memoryview(data))
+        else:
+            client.notify_callback(None, data)
+    elapsed = time.perf_counter() - start
+
+    await device.close()
+    return {
+        "replayed": len(selected),
+        "elapsed_s": round(elapsed, 4),
+        "frames": client.framer.frames,
+        "dropped_frames": client.framer.dropped,
+        "state": device.state.as_dict(),
+        "schedule": device.schedule.as_list(),
+        "metrics": device.metrics.as_dict(),
+    }
+
+
+def main() -> None:
+    """Replay a capture and print or store the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="file saved by the stop_capture service")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="factor of the recorded speed, 0 replays as fast as possible",
+    )
+    parser.add_argument(
+        "--frames", action="store_true", help="replay decrypted frames, not chunks"
+    )
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    records = capture.load(args.capture)
+    kinds = {name: 0 for name in capture.KINDS.values()}
+    for _, kind, _ in records:
+        name = capture.KINDS.get(kind, "unknown")
+        kinds[name] = kinds.get(name, 0) + 1
+    frames = args.frames or not kinds["chunk"]
+
+    results = {
+        "capture": args.capture,
+        "records": kinds,
+        "mode": "frames" if frames else "chunks",
+        **asyncio.run(replay(records, args.speed, frames)),
+    }
+
+    output = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
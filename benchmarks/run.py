@@ -0,0 +1,278 @@
+"""Benchmark the codec, framing, decode and command paths of the integration.
+
+Runs without Bluetooth hardware, commands go to simulated devices. Results
+are written as JSON so runs can be compared over time:
+
+    python benchmarks/run.py --output results.json
+"""
+
+import argparse
+import asyncio
+from datetime import UTC, datetime
+import json
+import platform
+import statistics
+import sys
+import time
+
+from common import core
+
+encryption = core("encryption")
+framing = core("framing")
+protocol = core("protocol")
+simulator = core("simulator")
+
+SUITES = {}
+
+
+def suite(func):
+    """Register a benchmark suite."""
+    SUITES[func.__name__] = func
+    return func
+
+
+def summary(samples: list[float]) -> dict:
+    """Return latency percentiles in microseconds."""
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_us": round(statistics.fmean(samples) * 1e6, 3),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 3),
+        "p99_us": round(samples[int(len(samples) * 0.99)] * 1e6, 3),
+        "max_us": round(samples[-1] * 1e6, 3),
+    }
+
+
+def throughput(func, number: int, size: int) -> dict:
+    """Return operations and bytes per second of a function."""
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    elapsed = time.perf_counter() - start
+    return {
+        "ops_per_s": round(number / elapsed),
+        "mb_per_s": round(number * size / elapsed / 1e6, 3),
+    }
+
+
+def state_report(channel: int) -> bytearray:
+    """Return a padded state report frame."""
+    frame = protocol.STATE.pack(
+        protocol.CMD_STATE, 0, 1, channel, 200, 300, 400, 500
+    )
+    frame.extend(bytes(simulator.REPORT_SIZE - len(frame)))
+    return frame
+
+
+@suite
+def codec(args) -> dict:
+    """Encrypt and decrypt throughput of single notification chunks."""
+    payload = bytes(range(framing.CHUNK_SIZE))
+    chunk = encryption.encrypt(payload)
+    target = bytearray(64)
+    batch = [chunk] * 64
+    number = args.number
+    return {
+        "encrypt": throughput(
+            lambda: encryption.encrypt(payload), number, len(chunk)
+        ),
+        "decrypt": throughput(
+            lambda: encryption.decrypt(chunk), number, len(chunk)
+        ),
+        "decrypt_into": throughput(
+            lambda: encryption.decrypt_into(chunk, target), number, len(chunk)
+        ),
+        "decrypt_many_64": throughput(
+            lambda: encryption.decrypt_many(batch), number // 64, len(chunk) * 64
+        ),
+    }
+
+
+@suite
+def frames(args) -> dict:
+    """Frames reassembled per second from encrypted chunks."""
+    frame = state_report(100)
+    chunks = [
+        encryption.encrypt(frame[i : i + framing.CHUNK_SIZE])
+        for i in range(0, len(frame), framing.CHUNK_SIZE)
+    ]
+    received = []
+    assembler = framing.FrameAssembler(
+        lambda view: received.append(len(view)), protocol.FRAME_LENGTHS
+    )
+
+    number = args.number // len(chunks)
+    start = time.perf_counter()
+    for _ in range(number):
+        for chunk in chunks:
+            assembler.feed(chunk)
+    elapsed = time.perf_counter() - start
+    assert len(received) == number
+    return {
+        "chunks_per_frame": len(chunks),
+        "frames_per_s": round(number / elapsed),
+        "dropped": assembler.dropped,
+    }
+
+
+@suite
+def decode(args) -> dict:
+    """Latency from a decoded frame to the entity update handler."""
+    device_module = core("device")
+    policy = core("policy")
+
+    async def run() -> dict:
+        sim = simulator.SimulatedFluval()
+        device = device_module.Device(
+            "bench",
+            sim.device,
+            sim.advertisement(),
+            policy.ConnectionPolicy(policy.MODE_ON_DEMAND),
+            connector=sim.establish_connection,
+        )
+        handled = []
+        device.register_update(
+            "channel_1", lambda: handled.append(time.perf_counter())
+        )
+
+        reports = [memoryview(state_report(100)), memoryview(state_report(200))]
+        unchanged = []
+        changed = []
+        for i in range(args.number // 10):
+            start = time.perf_counter()
+            device.decode_update_packet(reports[i % 2])
+            changed.append(handled[-1] - start)
+            start = time.perf_counter()
+            device.decode_update_packet(reports[i % 2])
+            unchanged.append(time.perf_counter() - start)
+        await device.close()
+        return {"changed": summary(changed), "unchanged": summary(unchanged)}
+
+    return asyncio.run(run())
+
+
+@suite
+def commands(args) -> dict:
+    """End-to-end latency from Client.send until the write completed."""
+    client_module = core("client")
+    connection = core("connection")
+    policy = core("policy")
+
+    async def run() -> dict:
+        manager = connection.ConnectionManager(slots=args.slots or args.devices)
+        sims = [
+            simulator.SimulatedFluval(
+                f"00:00:00:00:{i // 256:02X}:{i % 256:02X}", latency=args.latency
+            )
+            for i in range(args.devices)
+        ]
+        clients = [
+            client_module.Client(
+                sim.device,
+                manager=manager,
+                policy=policy.ConnectionPolicy(policy.MODE_ALWAYS),
+                connector=sim.establish_connection,
+            )
+            for sim in sims
+        ]
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client.connect() for client in clients))
+        connect_time = time.perf_counter() - start
+
+        async def send(client, i: int) -> float:
+            start = time.perf_counter()
+            await client.send(
+                protocol.STATE.pack(protocol.CMD_SET_STATE, 0, 1, i % 1000, 0, 0, 0, 0),
+                f"bench_{i}",
+            )
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        samples = []
+        for i in range(args.commands):
+            samples += await asyncio.gather(*(send(client, i) for client in clients))
+        elapsed = time.perf_counter() - start
+
+        await asyncio.gather(*(client.stop() for client in clients))
+        return {
+            "devices": args.devices,
+            "link_latency_s": args.latency,
+            "connect_all_s": round(connect_time, 4),
+            "commands_per_s": round(len(samples) / elapsed),
+            "latency": summary(samples),
+        }
+
+    return asyncio.run(run())
+
+
+@suite
+def pipeline(args) -> dict:
+    """Command throughput of a burst to one device by pipeline window."""
+    client_module = core("client")
+    connection = core("connection")
+    policy = core("policy")
+
+    async def run(window: int) -> dict:
+        sim = simulator.SimulatedFluval(latency=args.latency)
+        client = client_module.Client(
+            sim.device,
+            manager=connection.ConnectionManager(),
+            policy=policy.ConnectionPolicy(policy.MODE_ALWAYS, pipeline_window=window),
+            connector=sim.establish_connection,
+        )
+        await client.connect()
+        # Let the answer to the handshake arrive
+        await asyncio.sleep(args.latency * 2)
+
+        packets = [
+            protocol.STATE.pack(protocol.CMD_SET_STATE, 0, 1, i % 1000, 0, 0, 0, 0)
+            for i in range(args.commands * 4)
+        ]
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(client.send(packet, f"bench_{i}") for i, packet in enumerate(packets))
+        )
+        elapsed = time.perf_counter() - start
+        await client.stop()
+        return {
+            "commands_per_s": round(len(packets) / elapsed),
+            "retransmits": client.metrics.counters.get("retransmits", 0),
+        }
+
+    return {f"window_{window}": asyncio.run(run(window)) for window in (0, 1, 4, 8)}
+
+
+def main() -> None:
+    """Run the selected suites and print or store the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("suites", nargs="*", help=f"any of {', '.join(SUITES)}")
+    parser.add_argument("--number", type=int, default=100_000)
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--commands", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.001)
+    parser.add_argument("--slots", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+    if unknown := set(args.suites) - set(SUITES):
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    results = {
+        "timestamp": datetime.now(UTC).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": {},
+    }
+    for name in args.suites or SUITES:
+        results["results"][name] = SUITES[name](args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,33 @@ from __future__ import annotations
 
 import logging
 
+from bleak import BLEDevice
+
 from homeassistant.components import bluetooth
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.const import CONF_MAC
+from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.typing import ConfigType
 
-from .core import DOMAIN
+from .core import (
+    CONF_CONNECTION_MODE,
+    CONF_IDLE_TIMEOUT,
+    CONF_METRICS,
+    CONF_PASSIVE_SCAN,
+    CONF_PIPELINE,
+    CONF_WRITES,
+    DOMAIN,
+)
+from .core.connection import manager
 from .core.device import Device
+from .core.metrics import Metrics
+from .core.policy import DEFAULT_PIPELINE_WINDOW, MODE_ALWAYS, ConnectionPolicy
+from .services import async_setup_services
+from .store import DeviceCache
+
+_LOGGER = logging.getLogger(__name__)
 
 # TODO List the platforms that you want to support.
 # For your initial PR, limit it to 1 platform.
@@ -18,52 +37,141 @@ PLATFORMS: list[Platform] = [
     Platform.NUMBER,
     Platform.BINARY_SENSOR,
     Platform.SELECT,
+    Platform.SENSOR,
     Platform.SWITCH,
 ]
 
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
+
+
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """Set up the services of the Fluval Aquarium LED integration."""
+    async_setup_services(hass)
+    return True
+
+
+@callback
+def update_slots(
+    hass: HomeAssistant, allocations: bluetooth.HaBluetoothSlotAllocations
+) -> None:
+    """Limit the connections through an adapter to the slots it reports."""
+    if not allocations.slots:
+        return
+    manager.set_limit(allocations.source, allocations.slots)
+    # Devices seen by local adapters carry the adapter name instead of the
+    # source, see adapter_of
+    scanner = bluetooth.async_scanner_by_source(hass, allocations.source)
+    if scanner and scanner.adapter:
+        manager.set_limit(scanner.adapter, allocations.slots)
+
+
+@callback
+def async_update_slots(hass: HomeAssistant) -> None:
+    """Limit the connections of all adapters to their current slots."""
+    for allocations in bluetooth.async_current_allocations(hass) or ():
+        update_slots(hass, allocations)
+
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Fluval Aquarium LED from a config entry."""
     devices = hass.data.setdefault(DOMAIN, {})
+    async_update_slots(hass)
+    entry.async_on_unload(
+        bluetooth.async_register_allocation_callback(
+            hass, lambda allocations: update_slots(hass, allocations)
+        )
+    )
     logging.debug("Entry ID: " + entry.entry_id)
     logging.debug("Entry Title: " + entry.title)
     logging.debug("Entry Conf_mac: " + str(entry.data[CONF_MAC]))
 
+    mac = entry.data[CONF_MAC]
+    if entry.unique_id is None:
+        # Entries created before bluetooth discovery have no unique id, which
+        # discovery needs to recognize them
+        hass.config_entries.async_update_entry(entry, unique_id=mac.upper())
+    policy = ConnectionPolicy(
+        mode=entry.options.get(CONF_CONNECTION_MODE, MODE_ALWAYS),
+        idle_timeout=entry.options.get(CONF_IDLE_TIMEOUT, 120),
+        pipeline_window=DEFAULT_PIPELINE_WINDOW
+        if entry.options.get(CONF_PIPELINE, False)
+        else 0,
+    )
+    # Loaded before the device starts connecting, so no report can arrive
+    # before the cached values are restored
+    cache = DeviceCache(hass, entry.entry_id)
+    snapshot = await cache.async_load()
+    # Set up from the bluetooth cache instead of waiting for an advertisement.
+    # A device that has not been seen yet starts with unavailable entities.
+    if service_info := bluetooth.async_last_service_info(hass, mac, connectable=True):
+        ble_device, advertisement = service_info.device, service_info
+    else:
+        ble_device, advertisement = BLEDevice(mac, entry.title, {}), None
+    device = devices[entry.entry_id] = Device(
+        entry.title,
+        ble_device,
+        advertisement,
+        policy,
+        metrics=Metrics(entry.options.get(CONF_METRICS, True)),
+        writes=entry.options.get(CONF_WRITES, False),
+    )
+
+    # Restore the last known values right away, the device reconciles them
+    # once it reports in
+    cache.attach(device, snapshot)
+
     @callback
     def update_ble(
         service_info: bluetooth.BluetoothServiceInfoBleak,
         change: bluetooth.BluetoothChange,
     ) -> None:
-        logging.info("XXX Service Device: " + str(service_info.device))
-        logging.info("XXX Service Advertisement: " + str(service_info.advertisement))
-        if device := devices.get(entry.entry_id):
-            device.update_ble(service_info)
-            return
-
-        devices[entry.entry_id] = Device(
-            entry.title, service_info.device, service_info.advertisement
+        _LOGGER.debug(
+            "Advertisement from %s, rssi %s", service_info.address, service_info.rssi
         )
+        device.update_ble(service_info, service_info.device)
 
-        hass.create_task(
-            hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
-        )
+    @callback
+    def unavailable(service_info: bluetooth.BluetoothServiceInfoBleak) -> None:
+        _LOGGER.debug("%s is no longer seen", service_info.address)
+        device.set_present(False)
 
     # https://developers.home-assistant.io/docs/core/bluetooth/api/
     entry.async_on_unload(
         bluetooth.async_register_callback(
             hass,
             update_ble,
-            {"address": entry.data[CONF_MAC]},
-            bluetooth.BluetoothScanningMode.ACTIVE,
+            {"address": mac},
+            bluetooth.BluetoothScanningMode.PASSIVE
+            if entry.options.get(CONF_PASSIVE_SCAN, False)
+            else bluetooth.BluetoothScanningMode.ACTIVE,
         )
     )
+    entry.async_on_unload(
+        bluetooth.async_track_unavailable(hass, unavailable, mac, connectable=True)
+    )
+
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
+    entry.async_on_unload(cache.async_save)
+
+    await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
     return True
 
 
+async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload the config entry after its options changed."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     if unload_ok := await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
-        hass.data[DOMAIN].pop(entry.entry_id)
+        if device := hass.data[DOMAIN].pop(entry.entry_id, None):
+            await device.close()
 
     return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Delete the cached state of a removed config entry."""
+    await DeviceCache(hass, entry.entry_id).async_remove()
@@ -1,18 +1,34 @@
 """Config flow for Fluval Aquarium LED integration."""
 from __future__ import annotations
 
+import asyncio
 import logging
 from typing import Any
 
+from bleak import BLEDevice
 import voluptuous as vol
 
 from homeassistant import config_entries
+from homeassistant.components import bluetooth
+from homeassistant.components.bluetooth import BluetoothServiceInfoBleak
 from homeassistant.const import CONF_MAC
-from homeassistant.core import HomeAssistant
-from homeassistant.data_entry_flow import FlowResult
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.data_entry_flow import AbortFlow, FlowResult
 from homeassistant.exceptions import HomeAssistantError
 
-from .core import DOMAIN
+from . import async_update_slots
+from .core import (
+    CONF_CONNECTION_MODE,
+    CONF_IDLE_TIMEOUT,
+    CONF_METRICS,
+    CONF_PASSIVE_SCAN,
+    CONF_PIPELINE,
+    CONF_WRITES,
+    DOMAIN,
+)
+from .core.client import Client
+from .core.connection import adapter_of, manager
+from .core.policy import MODE_ALWAYS, MODE_ON_DEMAND, MODES, ConnectionPolicy
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -20,20 +36,41 @@ _LOGGER = logging.getLogger(__name__)
 # To connect, only mac is required. Later we need things like number of lights etc.
 STEP_USER_DATA_SCHEMA = vol.Schema({vol.Required(CONF_MAC): str})
 
+# Choices of the user step besides the discovered tanks
+ADD_ALL = "add_all"
+MANUAL = "manual"
+# Advertised name of the tanks, see the bluetooth matcher in manifest.json
+LOCAL_NAME = "Fluval"
+# Seconds a connection test may take once a connection slot is free
+VALIDATE_TIMEOUT = 30
 
-class PlaceholderHub:
-    """Placeholder class to make tests pass.
 
-    TODO Remove this placeholder class and replace with things from your PyPI package.
-    """
+def entry_title(mac: str) -> str:
+    """Return the title of the config entry of a device."""
+    return "Fluval " + str([mac])
+
 
-    def __init__(self, mac: str) -> None:
-        """Initialize."""
-        self.mac = mac
+def is_fluval(service_info: BluetoothServiceInfoBleak) -> bool:
+    """Return if a discovered device is a Fluval LED."""
+    return (service_info.name or "").startswith(LOCAL_NAME)
 
-    async def connect_test(self) -> bool:
-        """Test if we can connect with the host."""
-        return True
+
+async def connect_test(device: BLEDevice, timeout: float = VALIDATE_TIMEOUT):
+    """Connect, do the handshake and wait for the first state report."""
+    reported = asyncio.Event()
+    client = Client(
+        device,
+        update_callback=lambda frame: reported.set(),
+        policy=ConnectionPolicy(MODE_ON_DEMAND),
+    )
+    try:
+        async with asyncio.timeout(timeout):
+            await client.connect()
+            await reported.wait()
+    except TimeoutError as e:
+        raise CannotConnect(f"No answer from {device.address}") from e
+    finally:
+        await client.stop()
 
 
 async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str, Any]:
@@ -41,20 +78,15 @@ async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str,
 
     Data has the keys from STEP_USER_DATA_SCHEMA with values provided by the user.
     """
-    # TODO validate the data can be used to set up a connection.
-
-    hub = PlaceholderHub(data[CONF_MAC])
+    mac = data[CONF_MAC]
+    device = bluetooth.async_ble_device_from_address(hass, mac, connectable=True)
+    if not device:
+        raise CannotConnect(f"{mac} has not been seen by any adapter")
 
-    if not await hub.connect_test():
-        raise CannotConnect
-
-    # If you cannot connect:
-    # throw CannotConnect
-    # If the authentication is wrong:
-    # InvalidAuth
+    await connect_test(device)
 
     # Return info that you want to store in the config entry.
-    return {"title": "Fluval " + str([data[CONF_MAC]])}
+    return {"title": entry_title(mac)}
 
 
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -62,24 +94,260 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
 
+    def __init__(self) -> None:
+        """Initialize the config flow."""
+        self.discovery: BluetoothServiceInfoBleak | None = None
+        # Connection tests of the add all step and the tanks that passed
+        self.test_task: asyncio.Task[list[str]] | None = None
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(
+        config_entry: config_entries.ConfigEntry,
+    ) -> config_entries.OptionsFlow:
+        """Create the options flow."""
+        return OptionsFlowHandler(config_entry)
+
+    async def async_step_bluetooth(
+        self, discovery_info: BluetoothServiceInfoBleak
+    ) -> FlowResult:
+        """Handle a tank found by the bluetooth matcher."""
+        await self._async_set_mac(discovery_info.address)
+        self.discovery = discovery_info
+        self.context["title_placeholders"] = {"name": discovery_info.name}
+        return await self.async_step_bluetooth_confirm()
+
+    async def async_step_bluetooth_confirm(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Confirm the setup of a discovered tank."""
+        errors: dict[str, str] = {}
+        if user_input is not None:
+            data = {CONF_MAC: self.discovery.address}
+            if result := await self._async_validate_and_create(data, errors):
+                return result
+
+        self._set_confirm_only()
+        return self.async_show_form(
+            step_id="bluetooth_confirm",
+            description_placeholders={"name": self.discovery.name},
+            errors=errors,
+        )
+
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
-        """Handle the initial step."""
+        """Handle the initial step.
+
+        Discovered tanks are offered for selection next to typing in a MAC,
+        which is asked for right away when none have been discovered.
+        """
+        errors: dict[str, str] = {}
+        if user_input is not None:
+            if user_input[CONF_MAC] == ADD_ALL:
+                return await self.async_step_add_all()
+            if user_input[CONF_MAC] == MANUAL:
+                return await self.async_step_manual()
+            if result := await self._async_add(user_input[CONF_MAC], errors):
+                return result
+
+        if not (discovered := self._async_discovered()):
+            return await self.async_step_manual()
+        choices = {info.address: f"{info.name} ({info.address})" for info in discovered}
+        if len(discovered) > 1:
+            choices = {ADD_ALL: f"All {len(discovered)} tanks", **choices}
+        choices[MANUAL] = "Enter a MAC address"
+        return self.async_show_form(
+            step_id="user",
+            data_schema=vol.Schema({vol.Required(CONF_MAC): vol.In(choices)}),
+            errors=errors,
+        )
+
+    async def async_step_manual(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Add a tank by its MAC address."""
         errors: dict[str, str] = {}
         if user_input is not None:
-            try:
-                info = await validate_input(self.hass, user_input)
-            except CannotConnect:
-                errors["base"] = "cannot_connect"
-            except Exception:  # pylint: disable=broad-except
-                _LOGGER.exception("Unexpected exception")
-                errors["base"] = "unknown"
+            if result := await self._async_add(user_input[CONF_MAC], errors):
+                return result
+
+        return self.async_show_form(
+            step_id="manual", data_schema=STEP_USER_DATA_SCHEMA, errors=errors
+        )
+
+    async def async_step_add_all(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Test all discovered tanks at once, showing progress meanwhile."""
+        if not self.test_task:
+            self.test_task = self.hass.async_create_task(self._async_test_all())
+        if not self.test_task.done():
+            return self.async_show_progress(
+                step_id="add_all",
+                progress_action="add_all",
+                progress_task=self.test_task,
+            )
+        return self.async_show_progress_done(next_step_id="add_all_done")
+
+    async def async_step_add_all_done(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Add the tanks that answered the connection test."""
+        found = self.test_task.result()
+        if not found:
+            return self.async_abort(reason="cannot_connect")
+
+        # A flow creates a single entry, the others are imported
+        first, *others = found
+        for mac in others:
+            self.hass.async_create_task(
+                self.hass.config_entries.flow.async_init(
+                    DOMAIN,
+                    context={"source": config_entries.SOURCE_IMPORT},
+                    data={CONF_MAC: mac},
+                )
+            )
+        await self._async_set_mac(first, raise_on_progress=False)
+        return self.async_create_entry(title=entry_title(first), data={CONF_MAC: first})
+
+    async def async_step_import(self, import_data: dict[str, Any]) -> FlowResult:
+        """Add a tank that has been tested by the add all step."""
+        await self._async_set_mac(import_data[CONF_MAC], raise_on_progress=False)
+        return self.async_create_entry(
+            title=entry_title(import_data[CONF_MAC]), data=import_data
+        )
+
+    async def _async_test_all(self) -> list[str]:
+        """Test the discovered tanks and return the MACs of those that answered.
+
+        Tests share the connection slots of the adapters, so at most as many
+        run in parallel per adapter as it has slots.
+        """
+        semaphores: dict[str, asyncio.Semaphore] = {}
+        async_update_slots(self.hass)
+
+        async def test(info: BluetoothServiceInfoBleak):
+            adapter = adapter_of(info.device)
+            if adapter not in semaphores:
+                semaphores[adapter] = asyncio.Semaphore(manager.limit(adapter))
+            async with semaphores[adapter]:
+                await connect_test(info.device)
+
+        discovered = self._async_discovered()
+        results = await asyncio.gather(
+            *(test(info) for info in discovered), return_exceptions=True
+        )
+        found = []
+        for info, result in zip(discovered, results):
+            if result is None:
+                found.append(info.address)
             else:
-                return self.async_create_entry(title=info["title"], data=user_input)
+                _LOGGER.warning("Skipping %s: %s", info.address, result)
+        return found
+
+    async def _async_add(self, mac: str, errors: dict[str, str]) -> FlowResult | None:
+        """Add a tank chosen or typed in by the user if it answers.
+
+        Discovery flows of the same tank may be in progress, they are aborted
+        once the entry is created instead of aborting this flow.
+        """
+        data = {CONF_MAC: mac.upper()}
+        await self._async_set_mac(data[CONF_MAC], raise_on_progress=False)
+        return await self._async_validate_and_create(data, errors)
+
+    async def _async_validate_and_create(
+        self, data: dict[str, Any], errors: dict[str, str]
+    ) -> FlowResult | None:
+        """Create the entry if the device answers, otherwise fill errors."""
+        try:
+            info = await validate_input(self.hass, data)
+        except CannotConnect as e:
+            _LOGGER.debug("Connection test failed: %s", e)
+            errors["base"] = "cannot_connect"
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Unexpected exception")
+            errors["base"] = "unknown"
+        else:
+            return self.async_create_entry(title=info["title"], data=data)
+        return None
+
+    async def _async_set_mac(self, mac: str, raise_on_progress: bool = True):
+        """Set the unique id of the flow, aborting if the tank is configured."""
+        await self.async_set_unique_id(mac, raise_on_progress=raise_on_progress)
+        self._abort_if_unique_id_configured()
+        if mac.upper() in self._async_configured_macs():
+            raise AbortFlow("already_configured")
+
+    @callback
+    def _async_configured_macs(self) -> set[str]:
+        """Return the MACs of all entries.
+
+        Entries created before discovery have no unique id until they are
+        set up again, so their MAC is taken from the entry data.
+        """
+        return {
+            mac.upper()
+            for entry in self._async_current_entries(include_ignore=False)
+            if (mac := entry.unique_id or entry.data.get(CONF_MAC))
+        }
+
+    @callback
+    def _async_discovered(self) -> list[BluetoothServiceInfoBleak]:
+        """Return the discovered tanks that are not configured yet."""
+        configured = self._async_configured_macs() | set(self._async_current_ids())
+        return [
+            info
+            for info in bluetooth.async_discovered_service_info(self.hass)
+            if info.address not in configured and is_fluval(info)
+        ]
+
+
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    """Handle the connection options of a Fluval Aquarium LED."""
+
+    def __init__(self, config_entry: config_entries.ConfigEntry) -> None:
+        """Initialize options flow."""
+        self.entry = config_entry
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the connection options."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
 
+        options = self.entry.options
         return self.async_show_form(
-            step_id="user", data_schema=STEP_USER_DATA_SCHEMA, errors=errors
+            step_id="init",
+            data_schema=vol.Schema(
+                {
+                    vol.Required(
+                        CONF_CONNECTION_MODE,
+                        default=options.get(CONF_CONNECTION_MODE, MODE_ALWAYS),
+                    ): vol.In(MODES),
+                    vol.Required(
+                        CONF_IDLE_TIMEOUT,
+                        default=options.get(CONF_IDLE_TIMEOUT, 120),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=10)),
+                    vol.Required(
+                        CONF_PASSIVE_SCAN,
+                        default=options.get(CONF_PASSIVE_SCAN, False),
+                    ): bool,
+                    vol.Required(
+                        CONF_METRICS,
+                        default=options.get(CONF_METRICS, True),
+                    ): bool,
+                    vol.Required(
+                        CONF_PIPELINE,
+                        default=options.get(CONF_PIPELINE, False),
+                    ): bool,
+                    vol.Required(
+                        CONF_WRITES,
+                        default=options.get(CONF_WRITES, False),
+                    ): bool,
+                }
+            ),
         )
 
 
@@ -1,3 +1,10 @@
 """Constants for the Fluval Aquarium LED integration."""
 
 DOMAIN = "fluvalble"
+
+CONF_CONNECTION_MODE = "connection_mode"
+CONF_IDLE_TIMEOUT = "idle_timeout"
+CONF_PASSIVE_SCAN = "passive_scan"
+CONF_METRICS = "metrics"
+CONF_PIPELINE = "pipeline"
+CONF_WRITES = "writes"
@@ -0,0 +1,84 @@
+"""Capture of the packets exchanged with a Fluval for offline replay.
+
+Records are kept in a ring buffer of packed binary records and can be saved
+to a file. Every record holds a monotonic timestamp, its kind and the bytes:
+
+    <d timestamp> <B kind> <H length> <length bytes>
+
+A file starts with MAGIC and the format VERSION.
+"""
+
+from collections import deque
+from collections.abc import Iterator
+import struct
+import time
+
+from .encryption import Buffer
+
+MAGIC = b"FLVCAP"
+VERSION = 1
+FILE_HEADER = struct.Struct("<6sB")
+RECORD_HEADER = struct.Struct("<dBH")
+
+# Encrypted notification chunk as received
+KIND_CHUNK = 0
+# Decrypted frame reassembled from chunks
+KIND_FRAME = 1
+# Plain command written to the Fluval
+KIND_WRITE = 2
+KINDS = {KIND_CHUNK: "chunk", KIND_FRAME: "frame", KIND_WRITE: "write"}
+
+DEFAULT_RECORDS = 4096
+
+
+class Capture:
+    """Ring buffer of the latest packets."""
+
+    def __init__(self, records: int = DEFAULT_RECORDS) -> None:
+        """Initialize the capture keeping up to records packets."""
+        self.records: deque[bytes] = deque(maxlen=records)
+        self.started = time.monotonic()
+
+    def __len__(self) -> int:
+        """Return the number of captured packets."""
+        return len(self.records)
+
+    def record(self, kind: int, data: Buffer):
+        """Add a packet."""
+        self.records.append(
+            RECORD_HEADER.pack(time.monotonic(), kind, len(data)) + data
+        )
+
+    def dump(self) -> bytes:
+        """Return the capture in the file format."""
+        return FILE_HEADER.pack(MAGIC, VERSION) + b"".join(self.records)
+
+    def save(self, path: str):
+        """Write the capture to a file, this blocks."""
+        with open(path, "wb") as file:
+            file.write(self.dump())
+
+
+def parse(data: Buffer) -> Iterator[tuple[float, int, bytes]]:
+    """Iterate over timestamp, kind and bytes of the records of a capture."""
+    view = memoryview(data)
+    if len(view) < FILE_HEADER.size:
+        raise ValueError("Capture is truncated")
+    magic, version = FILE_HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a capture of a supported version")
+
+    offset = FILE_HEADER.size
+    while offset + RECORD_HEADER.size <= len(view):
+        timestamp, kind, length = RECORD_HEADER.unpack_from(view, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(view):
+            raise ValueError("Capture is truncated")
+        yield timestamp, kind, bytes(view[offset : offset + length])
+        offset += length
+
+
+def load(path: str) -> list[tuple[float, int, bytes]]:
+    """Read all records of a capture file, this blocks."""
+    with open(path, "rb") as file:
+        return list(parse(file.read()))
@@ -1,7 +1,7 @@
 """Client class connecting the Fluval BLE Entity to a bluetooth connection."""
 
 import asyncio
-from collections.abc import Callable
+from collections.abc import Awaitable, Callable
 import contextlib
 import logging
 import time
@@ -9,139 +9,508 @@ import time
 from bleak import BleakClient, BleakError, BleakGATTCharacteristic, BLEDevice
 from bleak_retry_connector import establish_connection
 
-from . import encryption
+from . import encryption, protocol
+from .capture import KIND_CHUNK, KIND_FRAME, KIND_WRITE, Capture
+from .commands import PRIORITY_HIGH, PRIORITY_NORMAL, Command, CommandQueue, Window
+from .connection import ConnectionManager, adapter_of, manager as default_manager
+from .framing import FrameAssembler
+from .metrics import Metrics
+from .policy import CircuitBreaker, ConnectionPolicy, LinkStats
 
 _LOGGER = logging.getLogger(__name__)
 
-ACTIVE_TIME = 120
 COMMAND_TIME = 15
+DRAIN_TIME = 5
+
+UUID_HANDSHAKE = "00001001-0000-1000-8000-00805F9B34FB"
+UUID_DATA = "00001002-0000-1000-8000-00805F9B34FB"
+UUID_KEEPALIVE = "00001004-0000-1000-8000-00805F9B34FB"
+
+# The handshake is the only known state request, other requests for a state
+# report are written the same way
+STATE_REQUEST = bytes([protocol.FRAME_MARKER, protocol.CMD_STATE])
+KEY_STATE_REQUEST = "state_request"
+
+STATE_DISCONNECTED = "disconnected"
+STATE_CONNECTING = "connecting"
+STATE_HANDSHAKING = "handshaking"
+STATE_READY = "ready"
+STATE_DRAINING = "draining"
+# The link went away on its own and waits for the task to close it
+STATE_LOST = "lost"
+
+# States with a link to run GATT operations on
+LINK_STATES = (STATE_HANDSHAKING, STATE_READY, STATE_DRAINING)
+
+
+class CircuitOpenError(BleakError):
+    """The device failed too often and is not tried for a while."""
 
 
 class Client:
-    """Basic client handling BLE sending and callbacks."""
+    """Basic client handling BLE sending and callbacks.
+
+    A single task owns the connection and walks through the states
+    disconnected -> connecting -> handshaking -> ready -> draining, or to lost
+    when the link drops. The link is opened lazily on first use and shared by
+    all operations.
+    """
 
     def __init__(
         self,
         device: BLEDevice,
         status_callback: Callable = None,
         update_callback: Callable = None,
+        manager: ConnectionManager | None = None,
+        policy: ConnectionPolicy | None = None,
+        connector: Callable | None = None,
+        metrics: Metrics | None = None,
+        breaker_callback: Callable | None = None,
     ) -> None:
-        """Initialize the client."""
+        """Initialize the client.
+
+        The connector replaces establish_connection, for example to talk to a
+        simulated device. The breaker callback is called once the circuit
+        breaker trips or closes again.
+        """
         self.device = device
         self.status_callback = status_callback
         self.update_callback = update_callback
+        self.manager = manager or default_manager
+        self.policy = policy or ConnectionPolicy()
+        self.connector = connector or establish_connection
+        self.link_stats = LinkStats()
+        self.metrics = metrics or Metrics()
+        self.breaker = CircuitBreaker(
+            self.policy.breaker_threshold, self.policy.breaker_reset
+        )
+        self.breaker_callback = breaker_callback
 
         self.client: BleakClient | None = None
+        self.state = STATE_DISCONNECTED
+        self.ready = asyncio.Event()
+        # Set by the first state report of a link, commands wait for it
+        self.reported = asyncio.Event()
 
-        self.ping_future: asyncio.Future | None = None
         self.ping_task: asyncio.Task | None = None
         self.ping_time = 0
+        self.activity_time = 0
+        self.drain_requested = False
+        self.stopped = False
+        # Set by stop, cuts the breaker and backoff sleeps short
+        self.stopping = asyncio.Event()
+
+        # Set to a Capture to record the packets, costs nothing while None
+        self.capture: Capture | None = None
+
+        self.queue = CommandQueue(COMMAND_TIME)
+        self.window = Window(
+            self.policy.pipeline_window,
+            self.policy.ack_timeout,
+            self.policy.max_retransmits,
+        )
+        self.framer = FrameAssembler(self.frame_callback, protocol.FRAME_LENGTHS)
 
-        self.send_data = None
-        self.send_time = 0
-        self.connect_task = asyncio.create_task(self._connect())
-
-        self.receive_buffer = b""
+    def start(self):
+        """Start the connection task if the policy wants a background link."""
+        if self.policy.persistent or self.policy.next_sync() is not None:
+            self._start_task()
 
     def ping(self):
         """Start the ping task to periodically talk to the Fluval."""
-        self.ping_time = time.time() + ACTIVE_TIME
-
-        if not self.ping_task:
-            self.ping_task = asyncio.create_task(self._ping_loop())
+        self.activity_time = time.time()
+        self.ping_time = self.activity_time + self.policy.idle_timeout
+        if self.state == STATE_DISCONNECTED:
+            # The task may be waiting for the next sync window
+            self.queue.wake()
+        self._start_task()
+
+    async def connect(self):
+        """Wait until the link is ready, connecting if necessary."""
+        if not self.breaker.allow():
+            raise self._circuit_open()
+        self.ping()
+        await self.ready.wait()
 
     def notify_callback(self, sender: BleakGATTCharacteristic, data: bytearray):
         """Handle packets sent by the Fluval."""
-        decrypted = decrypt(data)
-        if len(decrypted) == 17:
-            self.receive_buffer += decrypted
-        else:
-            _LOGGER.debug("Got all data: %s ", to_hex(self.receive_buffer))
-            self.update_callback(self.receive_buffer)
-            self.receive_buffer = b""
-
-    async def _connect(self):
-        """Connect to the Fluval and subscribe to notifications."""
-        self.client = await establish_connection(
-            BleakClient, self.device, self.device.address
-        )
+        if self.capture is not None:
+            self.capture.record(KIND_CHUNK, data)
+        self.framer.feed(data)
+
+    def frame_callback(self, frame: memoryview):
+        """Handle a complete frame reassembled from notifications."""
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Got all data: %s ", to_hex(frame))
+        if self.capture is not None:
+            self.capture.record(KIND_FRAME, frame)
+        if (
+            len(frame) >= protocol.STATE.size
+            and protocol.layout_for(frame) is protocol.STATE
+        ):
+            # Same rule as decoding, the type byte of state reports is unknown
+            self.reported.set()
+            if self.window:
+                self.window.ack(frame)
+        if self.update_callback:
+            self.update_callback(frame)
+
+    def send(
+        self,
+        data: bytes | Callable[[], bytes],
+        key: str | None = None,
+        priority: int = PRIORITY_NORMAL,
+    ) -> asyncio.Future:
+        """Queue a packet for the Fluval.
+
+        Packets with the same key replace each other while waiting, the
+        returned future is resolved once the packet has been written. A
+        callable is only called for the packet right before writing it.
+        While the circuit breaker is open the future fails right away.
+        """
+        future = self.queue.put(data, key, priority)
+        if not self.breaker.allow():
+            self.queue.clear(self._circuit_open())
+            return future
+        self.ping()
+        return future
+
+    def request_state(self) -> asyncio.Future:
+        """Ask the Fluval for a state report.
+
+        A request still waiting when the link opens is resolved by the
+        handshake, whose report answers it as well.
+        """
+        return self.send(STATE_REQUEST, KEY_STATE_REQUEST, PRIORITY_HIGH)
+
+    async def stop(self):
+        """Write the queued packets, disconnect and stop the connection task."""
+        self.stopped = True
+        self.stopping.set()
+        if task := self.ping_task:
+            self.queue.wake()
+            try:
+                async with asyncio.timeout(DRAIN_TIME):
+                    await asyncio.shield(task)
+            except TimeoutError:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+        self.queue.clear()
 
-        await self.client.start_notify(
-            "00001002-0000-1000-8000-00805F9B34FB", self.notify_callback
-        )
+    def _start_task(self):
+        if not self.ping_task and not self.stopped:
+            self.ping_task = asyncio.create_task(self._ping_loop())
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        _LOGGER.debug("%s: %s -> %s", self.device.address, self.state, state)
+        self.state = state
+        if state == STATE_READY:
+            self.ready.set()
+            if self.status_callback:
+                self.status_callback(True)
+        elif state in (STATE_LOST, STATE_DISCONNECTED):
+            self.ready.clear()
+            if self.status_callback:
+                self.status_callback(False)
 
-        if self.status_callback:
-            self.status_callback(True)
+    async def _ping_loop(self):
+        """Own the connection and ping the Fluval to keep it.
+
+        Depending on the connection policy the loop keeps the link open
+        forever or until it has been idle for the idle timeout.
+        """
+        # TODO: Set current time instead of dummy packet
+        failures = 0
+        try:
+            while not self.stopped:
+                if not self._active():
+                    if (delay := self.policy.next_sync()) is None:
+                        break
+                    # Sleep until the next sync window and stay connected for
+                    # it, commands and pings wake up early like on demand
+                    if not await self.queue.wait(delay):
+                        self.ping_time = time.time() + self.policy.sync_duration
+                    continue
+                if not self.breaker.allow():
+                    await self._sleep(self.breaker.remaining())
+                    continue
+
+                failed = False
+                try:
+                    await self._open()
+                    failures = 0
+                    await self._serve()
+                    await self._drain()
+                except TimeoutError:
+                    failed = True
+                except BleakError as e:
+                    failed = True
+                    _LOGGER.debug("ping error", exc_info=e)
+                except Exception as e:
+                    failed = True
+                    _LOGGER.warning("ping error", exc_info=e)
+                finally:
+                    if failed:
+                        failures += 1
+                        self._failed()
+                        # Nothing else takes commands off the queue while
+                        # the link is down
+                        self.queue.expire()
+                    await self._close(failed)
+
+                if not self.stopped:
+                    await self._sleep(
+                        max(self.policy.backoff(failures), self.breaker.remaining())
+                    )
+        finally:
+            self.ping_task = None
+
+    async def _sleep(self, delay: float):
+        """Sleep for delay seconds or until the client is stopped."""
+        with contextlib.suppress(TimeoutError):
+            async with asyncio.timeout(delay):
+                await self.stopping.wait()
+
+    async def _open(self):
+        """Connect, subscribe to notifications and do the handshake.
+
+        The link is ready once the Fluval answered the handshake with its
+        state, so commands are never encoded from a stale state.
+        """
+        self._set_state(STATE_CONNECTING)
+        self.drain_requested = False
+        self.framer.reset()
+        self.reported.clear()
+        start = self.metrics.start()
+        self.client = await self._establish()
+        self.metrics.stop("connect", start)
+        self.metrics.count("connects")
+        if self.link_stats.connects:
+            self.metrics.count("reconnects")
+        self.link_stats.connected()
+
+        self._set_state(STATE_HANDSHAKING)
+        start = self.metrics.start()
+        await self._gatt(self.client.start_notify, UUID_DATA, self.notify_callback)
 
         # Step 0
-        await self.client.read_gatt_char("00001004-0000-1000-8000-00805F9B34FB")
+        await self._gatt(self.client.read_gatt_char, UUID_KEEPALIVE)
 
         # Step 1
-
-        await self.client.write_gatt_char(
-            "00001001-0000-1000-8000-00805F9B34FB",
-            data=encrypt([0x68, 0x05]),
-            response=False,
+        await self._write_packet(STATE_REQUEST, response=False)
+        async with asyncio.timeout(self.policy.gatt_timeout):
+            await self.reported.wait()
+        self.queue.resolve(KEY_STATE_REQUEST)
+        self.metrics.stop("handshake", start)
+
+        if self.breaker.success():
+            _LOGGER.info("%s: reachable again", self.device.address)
+            if self.breaker_callback:
+                self.breaker_callback()
+        self._set_state(STATE_READY)
+
+    async def _serve(self):
+        """Write queued commands and keep the link alive while it is wanted."""
+        while self._active() and not self.drain_requested:
+            timeout = self._heartbeat()
+            if self.window:
+                timeout = min(timeout, self.window.wait_time())
+            command = await self.queue.get(timeout)
+            if self.state != STATE_READY:
+                if command:
+                    command.done(BleakError("Disconnected"))
+                raise BleakError("Disconnected")
+            if command is None:
+                if self.window:
+                    await self._await_ack()
+                elif self._active() and not self.drain_requested:
+                    # important dummy read for keep connection
+                    start = self.metrics.start()
+                    await self._gatt(self.client.read_gatt_char, UUID_KEEPALIVE)
+                    self.metrics.stop("read", start)
+                continue
+
+            await self._write(command)
+
+    async def _drain(self):
+        """Write the commands still queued before disconnecting."""
+        self._set_state(STATE_DRAINING)
+        while command := self.queue.get_nowait():
+            await self._write(command)
+        while self.window:
+            await self._await_ack()
+
+    async def _write(self, command: Command):
+        self.activity_time = time.time()
+        self.manager.touch(self)
+        pipelined = self.policy.pipelined
+        start = self.metrics.start()
+        try:
+            while pipelined and self.window.full:
+                await self._await_ack()
+            if callable(command.data):
+                command.data = command.data()
+            await self._write_packet(command.data, response=not pipelined)
+        except BaseException as e:
+            command.done(e)
+            raise
+        self.metrics.stop("write", start)
+        if self.capture is not None:
+            self.capture.record(KIND_WRITE, command.data)
+        if self.metrics.enabled:
+            self.metrics.observe("queue", time.monotonic() - command.queued)
+        if pipelined:
+            self.window.add(command)
+        else:
+            command.done()
+
+    async def _await_ack(self):
+        """Wait for an acknowledgement, then resend timed out commands."""
+        self.window.acked.clear()
+        with contextlib.suppress(TimeoutError):
+            async with asyncio.timeout(self.window.wait_time()):
+                await self.window.acked.wait()
+        if self.state not in (STATE_READY, STATE_DRAINING):
+            raise BleakError("Disconnected")
+        for command in self.window.expired():
+            self.metrics.count("retransmits")
+            await self._write_packet(command.data, response=False)
+            self.window.add(command)
+
+    async def _write_packet(self, data: bytes, response: bool):
+        """Write a packet, state requests go where the handshake goes."""
+        if data == STATE_REQUEST:
+            char, response = UUID_HANDSHAKE, False
+        else:
+            char = UUID_DATA
+        await self._gatt(
+            self.client.write_gatt_char, char, data=encrypt(data), response=response
         )
 
-    def send(self, data: bytes):
-        """Send a packet to the Fluval."""
-        # if send loop active - we change sending data
-        self.send_time = time.time() + COMMAND_TIME
-        self.send_data = data
+    async def _gatt(self, operation: Callable[..., Awaitable], *args, **kwargs):
+        """Run a GATT operation within the deadline of the policy.
 
-        self.ping()
+        Timeouts and errors are retried after a jittered delay as long as the
+        link is up, so a hung operation cannot block the queue for long.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with asyncio.timeout(self.policy.gatt_timeout):
+                    return await operation(*args, **kwargs)
+            except TimeoutError:
+                self.metrics.count("gatt_timeouts")
+                if not self._retry(attempt):
+                    raise
+            except BleakError:
+                if not self._retry(attempt):
+                    raise
+            attempt += 1
+            self.metrics.count("gatt_retries")
+            await asyncio.sleep(self.policy.retry_delay(attempt))
+
+    def _retry(self, attempt: int) -> bool:
+        """Return if a failed GATT operation should be tried again."""
+        return (
+            attempt < self.policy.gatt_retries
+            and self.state in LINK_STATES
+            and self.client is not None
+            and self.client.is_connected
+        )
 
-        if self.ping_future:
-            self.ping_future.cancel()
+    def _failed(self):
+        """Count a failed connection towards the circuit breaker.
+
+        Every failure while the breaker is tripped, including failed probes,
+        fails the waiting commands.
+        """
+        tripped = self.breaker.failure()
+        if not self.breaker.tripped:
+            return
+        self.queue.clear(self._circuit_open())
+        # Only persistent links retry on their own, others wait for demand
+        self.ping_time = 0
+        if not tripped:
+            return
+        _LOGGER.warning(
+            "%s: %d failed connections in a row, giving up for %d s",
+            self.device.address,
+            self.breaker.failures,
+            self.breaker.reset,
+        )
+        self.metrics.count("breaker_trips")
+        if self.breaker_callback:
+            self.breaker_callback()
+
+    def _circuit_open(self) -> CircuitOpenError:
+        return CircuitOpenError(
+            f"{self.device.address} is unreachable, retrying in "
+            f"{self.breaker.remaining():.0f} s"
+        )
 
-    async def _ping_loop(self):
-        """Ping the Fluval to keep connection."""
-        # TODO: Set current time instead of dummy packet
-        loop = asyncio.get_event_loop()
-        while time.time() < self.ping_time or True:
-            try:
-                self.client = await establish_connection(
-                    BleakClient, self.device, self.device.address
-                )
-                if self.callback:
-                    self.callback(True)
+    async def _close(self, failed: bool):
+        """Disconnect and return the connection slot."""
+        client, self.client = self.client, None
+        if client:
+            with contextlib.suppress(BleakError, TimeoutError):
+                async with asyncio.timeout(self.policy.gatt_timeout):
+                    await client.disconnect()
+            self.link_stats.disconnected(failed)
+        elif failed:
+            self.link_stats.failures += 1
+        if failed:
+            self.metrics.count("failures")
+        self.window.clear(BleakError("Disconnected"))
+        self.manager.release(self)
+        self._set_state(STATE_DISCONNECTED)
+
+    def _active(self) -> bool:
+        """Return if the link should currently be open."""
+        if self.stopped:
+            return False
+        return (
+            self.policy.persistent
+            or time.time() < self.ping_time
+            or len(self.queue) > 0
+        )
 
-                # heartbeat loop
-                while time.time() < self.ping_time or True:
-                    # important dummy read for keep connection
-                    await self.client.read_gatt_char(
-                        "00001004-0000-1000-8000-00805F9B34FB"
-                    )
-                    if self.send_data:
-                        if time.time() < self.send_time:
-                            await self.client.write_gatt_char(
-                                "00001002-0000-1000-8000-00805F9B34FB",
-                                data=encrypt(self.send_data),
-                                response=True,
-                            )
-                        self.send_data = None
-
-                    # asyncio.sleep(10) with cancel
-                    self.ping_future = loop.create_future()
-                    loop.call_later(10, self.ping_future.cancel)
-                    with contextlib.suppress(asyncio.CancelledError):
-                        await self.ping_future
-
-                await self.client.disconnect()
-            except TimeoutError:
-                pass
-            except BleakError as e:
-                _LOGGER.debug("ping error", exc_info=e)
-            except Exception as e:
-                _LOGGER.warning("ping error", exc_info=e)
-            finally:
-                self.client = None
-                if self.status_callback:
-                    self.status_callback(False)
-                await asyncio.sleep(1)
-
-        self.ping_task = None
+    def _heartbeat(self) -> float:
+        """Return how long to wait for commands before the next keep-alive."""
+        now = time.time()
+        interval = self.policy.heartbeat(now - self.activity_time)
+        if self.policy.persistent:
+            return interval
+        return max(min(interval, self.ping_time - now), 0)
+
+    async def _establish(self) -> BleakClient:
+        """Connect to the Fluval once a connection slot is available."""
+        await self.manager.acquire(self, adapter_of(self.device), self._evict)
+        try:
+            async with asyncio.timeout(self.policy.connect_timeout):
+                return await self.connector(
+                    BleakClient,
+                    self.device,
+                    self.device.address,
+                    disconnected_callback=self._disconnected,
+                )
+        except BaseException:
+            self.manager.release(self)
+            raise
+
+    def _disconnected(self, client: BleakClient):
+        """Wake the connection task once the link is gone."""
+        if client is self.client and self.state in LINK_STATES:
+            self._set_state(STATE_LOST)
+            self.queue.wake()
+            self.window.acked.set()
+
+    def _evict(self):
+        """Close an idle link because another device needs the slot."""
+        self.drain_requested = True
+        self.queue.wake()
 
 
 def encrypt(data: bytearray) -> bytearray:
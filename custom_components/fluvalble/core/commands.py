@@ -0,0 +1,294 @@
+"""Per device queue of commands waiting to be written to the Fluval."""
+
+import asyncio
+from collections import deque
+from collections.abc import Callable, Iterable
+import heapq
+import itertools
+import time
+
+from . import protocol
+from .encryption import Buffer
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class Command:
+    """A packet waiting to be written to the Fluval, or a callable encoding it."""
+
+    __slots__ = (
+        "data",
+        "key",
+        "priority",
+        "future",
+        "expires",
+        "queued",
+        "attempts",
+        "deadline",
+    )
+
+    def __init__(
+        self,
+        data: bytes | Callable[[], bytes],
+        key: str | None,
+        priority: int,
+        future: asyncio.Future,
+        expires: float,
+    ) -> None:
+        """Initialize the command."""
+        self.data = data
+        self.key = key
+        self.priority = priority
+        self.future = future
+        self.expires = expires
+        self.queued = time.monotonic()
+        self.attempts = 0
+        self.deadline = 0.0
+
+    def done(self, exc: BaseException | None = None):
+        """Resolve the future of the command."""
+        if self.future.done():
+            return
+        if isinstance(exc, asyncio.CancelledError):
+            self.future.cancel()
+        elif exc:
+            self.future.set_exception(exc)
+        else:
+            self.future.set_result(None)
+
+
+class CommandQueue:
+    """Priority queue of commands coalescing updates to the same target.
+
+    Commands with the same key replace the data of a command still waiting in
+    the queue, so only the latest value is written and all callers share the
+    future of that write.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        """Initialize the queue."""
+        self.ttl = ttl
+        self._heap: list[tuple[int, int, Command]] = []
+        self._pending: dict[str, Command] = {}
+        self._counter = itertools.count()
+        self._event = asyncio.Event()
+
+    def __len__(self) -> int:
+        """Return the number of waiting commands that have not expired."""
+        self.expire()
+        return sum(
+            1
+            for priority, _, command in self._heap
+            if priority == command.priority and not command.future.done()
+        )
+
+    def expire(self):
+        """Fail the commands that waited longer than the ttl.
+
+        Without this commands would only expire when taken from the queue,
+        which never happens while the link cannot be opened.
+        """
+        now = time.monotonic()
+        expired = False
+        for _, _, command in self._heap:
+            if command.expires < now and not command.future.done():
+                command.done(TimeoutError("Command expired before it was sent"))
+                expired = True
+        if not expired:
+            return
+        self._heap = [entry for entry in self._heap if not entry[2].future.done()]
+        heapq.heapify(self._heap)
+        self._pending = {
+            key: command
+            for key, command in self._pending.items()
+            if not command.future.done()
+        }
+
+    def put(
+        self,
+        data: bytes | Callable[[], bytes],
+        key: str | None = None,
+        priority: int = PRIORITY_NORMAL,
+    ) -> asyncio.Future:
+        """Queue a packet and return a future resolved once it has been written."""
+        expires = time.monotonic() + self.ttl
+        if key is not None and (command := self._pending.get(key)):
+            command.data = data
+            command.expires = expires
+            if priority < command.priority:
+                # Re-queue with the higher priority, the old entry is skipped
+                command.priority = priority
+                heapq.heappush(self._heap, (priority, next(self._counter), command))
+            return command.future
+
+        future = asyncio.get_running_loop().create_future()
+        # Callers may fire and forget, failed writes must not log as unhandled
+        future.add_done_callback(_retrieve)
+        command = Command(data, key, priority, future, expires)
+        if key is not None:
+            self._pending[key] = command
+        heapq.heappush(self._heap, (priority, next(self._counter), command))
+        self._event.set()
+        return command.future
+
+    def put_many(
+        self, items: Iterable[tuple[str | None, bytes]], priority: int = PRIORITY_NORMAL
+    ) -> list[asyncio.Future]:
+        """Queue several keyed packets at once."""
+        return [self.put(data, key, priority) for key, data in items]
+
+    def resolve(self, key: str) -> bool:
+        """Resolve a waiting command without writing it.
+
+        Returns if a command with the key was waiting.
+        """
+        if not (command := self._pending.pop(key, None)):
+            return False
+        command.done()
+        return True
+
+    def get_nowait(self) -> Command | None:
+        """Return the next command that has not expired yet."""
+        now = time.monotonic()
+        while self._heap:
+            priority, _, command = heapq.heappop(self._heap)
+            if priority != command.priority or command.future.done():
+                # Stale heap entry of a command re-queued with higher priority
+                # or cancelled by its caller.
+                if command.future.done() and self._pending.get(command.key) is command:
+                    del self._pending[command.key]
+                continue
+            if command.key is not None:
+                del self._pending[command.key]
+            if command.expires < now:
+                command.done(TimeoutError("Command expired before it was sent"))
+                continue
+            return command
+        self._event.clear()
+        return None
+
+    async def get(self, timeout: float | None = None) -> Command | None:
+        """Wait for the next command.
+
+        Returns None after the timeout or when woken up without a command.
+        """
+        if (command := self.get_nowait()) is None:
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._event.wait()
+            except TimeoutError:
+                return None
+            command = self.get_nowait()
+        return command
+
+    async def wait(self, timeout: float | None = None) -> bool:
+        """Wait until a command is queued or wake is called.
+
+        Returns False after the timeout.
+        """
+        if not len(self):
+            self._event.clear()
+        try:
+            async with asyncio.timeout(timeout):
+                await self._event.wait()
+        except TimeoutError:
+            return False
+        return True
+
+    def wake(self):
+        """Wake up a consumer waiting in get."""
+        self._event.set()
+
+    def clear(self, exc: BaseException | None = None):
+        """Drop all waiting commands."""
+        for _, _, command in self._heap:
+            if exc:
+                command.done(exc)
+            elif not command.future.done():
+                command.future.cancel()
+        self._heap.clear()
+        self._pending.clear()
+        self._event.clear()
+
+
+class Window:
+    """Commands written without response waiting for an acknowledgement.
+
+    The Fluval answers every accepted packet with a state report, each report
+    acknowledges the oldest outstanding command if it can be its answer, see
+    protocol.answers. Commands that are not
+    acknowledged in time are handed out again for retransmission.
+    """
+
+    def __init__(self, size: int, timeout: float, retries: int) -> None:
+        """Initialize the window."""
+        self.size = size
+        self.timeout = timeout
+        self.retries = retries
+        self.acked = asyncio.Event()
+        self._commands: deque[Command] = deque()
+
+    def __len__(self) -> int:
+        """Return the number of outstanding commands."""
+        return len(self._commands)
+
+    @property
+    def full(self) -> bool:
+        """Return if no more commands may be written."""
+        return len(self._commands) >= self.size
+
+    def add(self, command: Command):
+        """Track a command that has just been written."""
+        command.attempts += 1
+        command.deadline = time.monotonic() + self.timeout
+        self._commands.append(command)
+
+    def ack(self, report: Buffer) -> Command | None:
+        """Resolve the oldest outstanding command answered by a state report."""
+        if not self._commands or not protocol.answers(report, self._commands[0].data):
+            return None
+        command = self._commands.popleft()
+        command.done()
+        self.acked.set()
+        return command
+
+    def wait_time(self) -> float | None:
+        """Return the seconds until the oldest command times out."""
+        if not self._commands:
+            return None
+        return max(self._commands[0].deadline - time.monotonic(), 0)
+
+    def expired(self) -> list[Command]:
+        """Remove and return the timed out commands that should be resent.
+
+        Commands superseded by a newer outstanding command with the same key
+        count as done, resending them would revert the newer one. Commands
+        out of retries fail.
+        """
+        now = time.monotonic()
+        resend = []
+        while self._commands and self._commands[0].deadline <= now:
+            command = self._commands.popleft()
+            if command.key is not None and any(
+                other.key == command.key for other in self._commands
+            ):
+                command.done()
+            elif command.attempts > self.retries:
+                command.done(TimeoutError("Command was not acknowledged"))
+            else:
+                resend.append(command)
+        return resend
+
+    def clear(self, exc: BaseException):
+        """Fail all outstanding commands."""
+        for command in self._commands:
+            command.done(exc)
+        self._commands.clear()
+        self.acked.set()
+
+
+def _retrieve(future: asyncio.Future):
+    if not future.cancelled():
+        future.exception()
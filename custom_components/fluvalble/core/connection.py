@@ -0,0 +1,175 @@
+"""Shared scheduler handing out BLE connection slots per adapter."""
+
+import asyncio
+from collections import deque
+from collections.abc import Callable
+import contextlib
+import logging
+import time
+
+from bleak import BLEDevice
+
+_LOGGER = logging.getLogger(__name__)
+
+# Slots of adapters that have not reported their own count, ESPHome proxies
+# allow three active connections by default.
+DEFAULT_SLOTS = 3
+# Connections unused for this long may be closed for a waiting device.
+IDLE_TIME = 30
+DEFAULT_ADAPTER = "default"
+
+
+def adapter_of(device: BLEDevice) -> str:
+    """Return the adapter or proxy a device is reached through."""
+    details = device.details
+    if isinstance(details, dict):
+        if source := details.get("source"):
+            return source
+        if path := details.get("path"):
+            # bluez object path like /org/bluez/hci0/dev_XX_XX_XX_XX_XX_XX
+            return path.split("/")[3] if path.count("/") > 3 else path
+    return DEFAULT_ADAPTER
+
+
+class Slot:
+    """A connection slot held by a client on one adapter."""
+
+    __slots__ = ("adapter", "owner", "acquired", "last_active", "release", "evicting")
+
+    def __init__(
+        self, adapter: str, owner: object, release: Callable | None = None
+    ) -> None:
+        """Initialize the slot."""
+        self.adapter = adapter
+        self.owner = owner
+        self.acquired = self.last_active = time.monotonic()
+        self.release = release
+        self.evicting = False
+
+
+class ConnectionManager:
+    """Limit the number of concurrent connections per adapter.
+
+    Clients acquire a slot before connecting and release it after
+    disconnecting. When all slots of an adapter are taken, waiting clients
+    are queued in order and the longest idle holder is asked to disconnect.
+    """
+
+    def __init__(self, slots: int = DEFAULT_SLOTS, idle_time: float = IDLE_TIME):
+        """Initialize the manager."""
+        self.slots = slots
+        self.idle_time = idle_time
+        self.limits: dict[str, int] = {}
+        self._holders: dict[str, dict[object, Slot]] = {}
+        self._waiters: dict[str, deque[tuple[object, Callable, asyncio.Future]]] = {}
+        self._owners: dict[object, Slot] = {}
+        self.evictions = 0
+
+    def set_limit(self, adapter: str, slots: int):
+        """Set the number of connection slots of an adapter."""
+        self.limits[adapter] = slots
+        self._wake(adapter)
+
+    def limit(self, adapter: str) -> int:
+        """Return the number of connection slots of an adapter."""
+        return self.limits.get(adapter, self.slots)
+
+    async def acquire(
+        self, owner: object, adapter: str, release: Callable | None = None
+    ) -> Slot:
+        """Wait for a free slot on the adapter.
+
+        The release callback is called when the slot is needed by another
+        client and the owner has been idle for too long. Acquiring again
+        while holding a slot returns the held slot.
+        """
+        if slot := self._owners.get(owner):
+            slot.last_active = time.monotonic()
+            return slot
+
+        holders = self._holders.setdefault(adapter, {})
+        waiters = self._waiters.setdefault(adapter, deque())
+        if len(holders) < self.limit(adapter) and not waiters:
+            return self._grant(owner, adapter, release)
+
+        future = asyncio.get_running_loop().create_future()
+        waiters.append((owner, release, future))
+        _LOGGER.debug("Waiting for slot on %s, queue depth %d", adapter, len(waiters))
+        try:
+            while not future.done():
+                self._evict_idle(adapter)
+                with contextlib.suppress(TimeoutError):
+                    async with asyncio.timeout(self.idle_time):
+                        await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.done():
+                # Granted while being cancelled, hand the slot on
+                self.release(owner)
+            else:
+                future.cancel()
+                waiters.remove((owner, release, future))
+            raise
+        return future.result()
+
+    def release(self, owner: object):
+        """Return the slot held by the owner."""
+        if not (slot := self._owners.pop(owner, None)):
+            return
+        del self._holders[slot.adapter][owner]
+        self._wake(slot.adapter)
+
+    def touch(self, owner: object):
+        """Mark the connection of the owner as in use."""
+        if slot := self._owners.get(owner):
+            slot.last_active = time.monotonic()
+
+    def queue_depth(self, adapter: str | None = None) -> int:
+        """Return the number of clients waiting for a slot."""
+        if adapter is not None:
+            return len(self._waiters.get(adapter, ()))
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def stats(self) -> dict:
+        """Return slot usage per adapter."""
+        return {
+            adapter: {
+                "limit": self.limit(adapter),
+                "connected": len(holders),
+                "waiting": self.queue_depth(adapter),
+            }
+            for adapter, holders in self._holders.items()
+        }
+
+    def _grant(self, owner: object, adapter: str, release: Callable | None) -> Slot:
+        slot = Slot(adapter, owner, release)
+        self._holders[adapter][owner] = slot
+        self._owners[owner] = slot
+        return slot
+
+    def _wake(self, adapter: str):
+        holders = self._holders.get(adapter, {})
+        waiters = self._waiters.get(adapter)
+        while waiters and len(holders) < self.limit(adapter):
+            owner, release, future = waiters.popleft()
+            if not future.done():
+                future.set_result(self._grant(owner, adapter, release))
+
+    def _evict_idle(self, adapter: str):
+        """Ask the longest idle holder of the adapter to disconnect."""
+        threshold = time.monotonic() - self.idle_time
+        candidates = [
+            slot
+            for slot in self._holders.get(adapter, {}).values()
+            if slot.release and not slot.evicting and slot.last_active < threshold
+        ]
+        if not candidates:
+            return
+        slot = min(candidates, key=lambda slot: slot.last_active)
+        slot.evicting = True
+        self.evictions += 1
+        _LOGGER.debug("Rotating out idle connection on %s", adapter)
+        slot.release()
+
+
+# Shared by all clients of this process
+manager = ConnectionManager()
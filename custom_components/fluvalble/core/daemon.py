@@ -0,0 +1,291 @@
+"""Standalone controller running Fluval devices without Home Assistant.
+
+A Fleet owns the devices of one adapter, or of all of them, and a scanner
+feeding their advertisements. The Api serves a small HTTP/JSON interface on
+TCP or a Unix socket:
+
+    GET  /devices                       all devices with their state
+    GET  /devices/<mac>?max_age=<s>     state, requested if older than max_age
+    GET  /devices/<mac>/schedule        professional mode schedule
+    GET  /devices/<mac>/diagnostics     link and timing information
+    POST /devices/<mac>/scene           {"mode": .., "channel_1": .., ...}
+    POST /devices/<mac>/transition      {"duration": .., "channel_1": .., ...}
+    POST /devices/<mac>/schedule        {"slots": [{"time": "08:00", "channels": [..]}]}
+    POST /scene                         {"devices": [..], "values": {..}}
+"""
+
+import asyncio
+from datetime import time as dt_time
+import json
+import logging
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+from bleak import AdvertisementData, BleakScanner, BLEDevice
+
+from .connection import DEFAULT_SLOTS, manager
+from .device import NUMBERS, Device, WritesDisabledError
+from .fleet import DEFAULT_CONCURRENCY, fan_out
+from .metrics import Metrics
+from .policy import DEFAULT_PIPELINE_WINDOW, MODE_ON_DEMAND, ConnectionPolicy
+from .schedule import ScheduleSlot
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8787
+MAX_BODY = 64 * 1024
+
+SCENE_KEYS = {"mode", "led_on_off", *NUMBERS}
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    500: "Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+class ApiError(Exception):
+    """Error answered with an HTTP status."""
+
+    def __init__(self, status: int, message: str) -> None:
+        """Initialize the error."""
+        super().__init__(message)
+        self.status = status
+
+
+class Fleet:
+    """Devices of one shard and the scanner keeping them up to date.
+
+    Devices are set up right away and stay absent until they advertise.
+    """
+
+    def __init__(self, config: dict[str, Any], adapter: str | None = None) -> None:
+        """Initialize the devices of the config, only those of adapter if given."""
+        self.adapter = adapter
+        self.devices: dict[str, Device] = {}
+        self.scanner: BleakScanner | None = None
+
+        for entry in config.get("devices", []):
+            # Devices without an adapter only run in the unsharded process
+            if adapter and entry.get("adapter") != adapter:
+                continue
+            mac = entry["mac"].upper()
+            policy = ConnectionPolicy(
+                mode=entry.get("mode", MODE_ON_DEMAND),
+                idle_timeout=entry.get("idle_timeout", 120),
+                pipeline_window=DEFAULT_PIPELINE_WINDOW
+                if entry.get("pipeline")
+                else 0,
+            )
+            name = entry.get("name", mac)
+            # The source makes adapter_of return the configured adapter, like
+            # it does for the bluez path of the devices found by the scanner
+            details = {"source": entry["adapter"]} if "adapter" in entry else {}
+            self.devices[mac] = Device(
+                name,
+                BLEDevice(mac, name, details),
+                None,
+                policy,
+                metrics=Metrics(entry.get("metrics", True)),
+                writes=entry.get("writes", False),
+            )
+
+        slots = config.get("slots", DEFAULT_SLOTS)
+        # Devices without a configured adapter use the default limit
+        manager.slots = slots
+        for entry in config.get("devices", []):
+            if "adapter" in entry:
+                manager.set_limit(entry["adapter"], slots)
+
+    async def start(self):
+        """Start scanning for the advertisements of the devices."""
+        kwargs = {"adapter": self.adapter} if self.adapter else {}
+        self.scanner = BleakScanner(self.detected, **kwargs)
+        await self.scanner.start()
+
+    async def stop(self):
+        """Stop scanning and disconnect all devices."""
+        if self.scanner:
+            await self.scanner.stop()
+        await asyncio.gather(*(device.close() for device in self.devices.values()))
+
+    def detected(self, ble_device: BLEDevice, advertisement: AdvertisementData):
+        """Pass an advertisement to its device."""
+        if device := self.devices.get(ble_device.address.upper()):
+            device.update_ble(advertisement, ble_device)
+
+    def get(self, mac: str, present: bool = False) -> Device:
+        """Return a device by MAC address, only one in range if present is set.
+
+        Until its first advertisement a device only has a placeholder BLEDevice
+        without the details BlueZ needs, so it is not connected to before.
+        """
+        if not (device := self.devices.get(mac.upper())):
+            raise ApiError(404, f"Unknown device {mac}")
+        if present and not device.present:
+            raise ApiError(503, f"Device {mac} is not in range")
+        return device
+
+
+class Api:
+    """HTTP/JSON interface of a fleet."""
+
+    def __init__(self, fleet: Fleet) -> None:
+        """Initialize the API."""
+        self.fleet = fleet
+
+    async def serve(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        socket: str | None = None,
+    ) -> asyncio.AbstractServer:
+        """Start listening on TCP or on a Unix socket."""
+        if socket:
+            return await asyncio.start_unix_server(self.handle, socket)
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer a single request and close the connection."""
+        try:
+            status, payload = await self.request(reader)
+        except ApiError as e:
+            status, payload = e.status, {"error": str(e)}
+        except WritesDisabledError as e:
+            status, payload = 403, {"error": str(e)}
+        except TimeoutError:
+            status, payload = 504, {"error": "The device did not answer in time"}
+        except ValueError as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:  # pylint: disable=broad-except
+            _LOGGER.exception("Request failed")
+            status, payload = 500, {"error": str(e) or type(e).__name__}
+
+        body = json.dumps(payload, default=str).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def request(self, reader: asyncio.StreamReader) -> tuple[int, Any]:
+        """Parse a request and route it."""
+        try:
+            method, target, _ = (await reader.readline()).decode().split(" ", 2)
+        except ValueError as e:
+            raise ApiError(400, "Malformed request line") from e
+        length = 0
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode().partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        if length > MAX_BODY:
+            raise ApiError(400, "Body too large")
+        body = await reader.readexactly(length) if length else b""
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError as e:
+            raise ApiError(400, "Body is not JSON") from e
+        if method.upper() == "POST" and not isinstance(data, dict):
+            raise ApiError(400, "Body must be a JSON object")
+
+        url = urlsplit(target)
+        query = {key: items[-1] for key, items in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+        return 200, await self.route(method.upper(), parts, query, data)
+
+    async def route(
+        self, method: str, parts: list[str], query: dict[str, str], data: Any
+    ) -> Any:
+        """Run the handler of a request."""
+        match method, parts:
+            case "GET", ["devices"]:
+                return {
+                    mac: self.describe(device)
+                    for mac, device in self.fleet.devices.items()
+                }
+            case "GET", ["devices", mac]:
+                device = self.fleet.get(mac, present="max_age" in query)
+                if "max_age" in query:
+                    await device.refresh(float(query["max_age"]))
+                return self.describe(device)
+            case "GET", ["devices", mac, "schedule"]:
+                schedule = await self.fleet.get(mac, present=True).sync_schedule()
+                return schedule.as_list()
+            case "GET", ["devices", mac, "diagnostics"]:
+                return self.fleet.get(mac).diagnostics()
+            case "POST", ["devices", mac, "scene"]:
+                await self.fleet.get(mac, present=True).apply(values(data))
+                return self.describe(self.fleet.get(mac))
+            case "POST", ["devices", mac, "transition"]:
+                if "duration" not in data:
+                    raise ApiError(400, "Missing duration")
+                duration = float(data.pop("duration"))
+                device = self.fleet.get(mac, present=True)
+                frames = await device.transition(values(data), duration)
+                return {"frames": frames}
+            case "POST", ["devices", mac, "schedule"]:
+                slots = sorted(
+                    (slot(entry) for entry in data.get("slots", [])),
+                    key=lambda item: (item.hour, item.minute),
+                )
+                device = self.fleet.get(mac, present=True)
+                written = await device.upload_schedule(slots)
+                return {"written": written}
+            case "POST", ["scene"]:
+                devices = [self.fleet.get(mac) for mac in data.get("devices", [])]
+                scene = values(data.get("values", {}))
+                return await fan_out(
+                    devices,
+                    lambda device: self.fleet.get(device.mac, True).apply(scene),
+                    int(data.get("concurrency", DEFAULT_CONCURRENCY)),
+                )
+        raise ApiError(404, f"No route for {method} /{'/'.join(parts)}")
+
+    @staticmethod
+    def describe(device: Device) -> dict[str, Any]:
+        """Return the public view of a device."""
+        return {
+            "name": device.name,
+            "available": device.available,
+            "connected": device.connected,
+            "state": device.state.as_dict(),
+        }
+
+
+def values(data: Any) -> dict[str, Any]:
+    """Check the keys and types of a scene, encode_state checks the ranges."""
+    if not isinstance(data, dict) or not data.keys() <= SCENE_KEYS:
+        raise ApiError(400, f"Values may only contain {', '.join(sorted(SCENE_KEYS))}")
+    if not isinstance(data.get("mode", ""), str):
+        raise ApiError(400, "mode must be a string")
+    if not isinstance(data.get("led_on_off", False), bool):
+        raise ApiError(400, "led_on_off must be true or false")
+    for attr in NUMBERS:
+        value = data.get(attr, 0)
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ApiError(400, f"{attr} must be an integer")
+    return data
+
+
+def slot(entry: dict[str, Any]) -> ScheduleSlot:
+    """Parse a schedule slot like {"time": "08:00", "channels": [..]}."""
+    try:
+        start = dt_time.fromisoformat(entry["time"])
+        channels = tuple(int(channel) for channel in entry["channels"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ApiError(400, f"Invalid slot {entry}") from e
+    if len(channels) != 5:
+        raise ApiError(400, "A slot has five channels")
+    return ScheduleSlot(start.hour, start.minute, channels)
@@ -1,19 +1,55 @@
 """A single Fluval BLE connected LED device."""
 
-from collections.abc import Callable
+import asyncio
+from collections.abc import Callable, Iterable
 from datetime import UTC, datetime
+import itertools
 import logging
-from typing import TypedDict
+import time
+from typing import Any, TypedDict
 
 from bleak import AdvertisementData, BLEDevice
 
+from . import protocol
+from .capture import DEFAULT_RECORDS, Capture
 from .client import Client
+from .metrics import Metrics
+from .policy import ConnectionPolicy
+from .schedule import Schedule, ScheduleSlot, decode_slot, encode_slot
 
 _LOGGER = logging.getLogger(__name__)
 
 NUMBERS = ["channel_1", "channel_2", "channel_3", "channel_4", "channel_5"]
 SELECTS = ["mode"]
+# Diagnostic sensors and the metric they show
+SENSORS = {
+    "connect_latency": "connect",
+    "write_latency": "write",
+    "command_latency": "queue",
+    "reconnects": "reconnects",
+}
 MODES = ["manual", "automatic", "professional"]
+CHANNEL_MAX = 1000
+
+# Advertisements only update the connection entity when the RSSI moved out of
+# the hysteresis band or last_seen advanced by the granularity, and at most
+# once per interval.
+RSSI_HYSTERESIS = 5
+LAST_SEEN_GRANULARITY = 60
+MIN_UPDATE_INTERVAL = 5
+
+SCHEDULE_TIMEOUT = 10
+REFRESH_TIMEOUT = 10
+# Seconds a written value waits for the state report confirming it before it
+# is rolled back to the last reported value
+CONFIRM_TIMEOUT = 5
+
+# Transitions write at most one frame per interval in seconds
+TRANSITION_INTERVAL = 0.1
+
+
+class WritesDisabledError(Exception):
+    """Commands of the device were sent without enabling writes."""
 
 
 class Attribute(TypedDict, total=False):
@@ -31,48 +67,177 @@ class Attribute(TypedDict, total=False):
     extra: dict
 
 
+class DeviceState:
+    """Decoded state of a Fluval LED device."""
+
+    __slots__ = (
+        "mode",
+        "led_on_off",
+        "channel_1",
+        "channel_2",
+        "channel_3",
+        "channel_4",
+        "channel_5",
+    )
+
+    def __init__(self) -> None:
+        """Initialize the state with the defaults shown before the first report."""
+        self.mode = MODES[0]
+        self.led_on_off = False
+        self.channel_1 = 0
+        self.channel_2 = 0
+        self.channel_3 = 0
+        self.channel_4 = 0
+        self.channel_5 = 0
+
+    def update(self, values: Iterable[tuple[str, Any]]) -> list[str]:
+        """Merge new values and return the names of the changed attributes."""
+        changed = []
+        for attr, value in values:
+            if getattr(self, attr) != value:
+                setattr(self, attr, value)
+                changed.append(attr)
+        return changed
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the state as dictionary."""
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+
 class Device:
     """Fluval BLE LED device class."""
 
     def __init__(
-        self, name: str, device: BLEDevice, advertisment: AdvertisementData
+        self,
+        name: str,
+        device: BLEDevice,
+        advertisment: AdvertisementData | None = None,
+        policy: ConnectionPolicy | None = None,
+        connector: Callable | None = None,
+        metrics: Metrics | None = None,
+        writes: bool = False,
     ) -> None:
-        """Initialize the device."""
+        """Initialize the device.
+
+        Without an advertisement the device counts as absent, its entities
+        are unavailable until it is seen. Set state and schedule commands are
+        only sent with writes, their layouts are not verified yet.
+        """
         self.name = name
-        self.client = Client(device, self.set_connected, self.decode_update_packet)
+        self.writes = writes
+        self.metrics = metrics or Metrics()
+        self.client = Client(
+            device,
+            self.set_connected,
+            self.decode_update_packet,
+            policy=policy,
+            connector=connector,
+            metrics=self.metrics,
+            breaker_callback=self.dispatch_available,
+        )
         self.connected = False
+        self.present = False
         self.conn_info = {"mac": device.address}
-        self.updates_connect: list = []
-        self.updates_component: list = []
-        self.values = {}
-        self.update_ble(advertisment)
-        self.values["channel_1"] = 0
-        self.values["channel_2"] = 0
-        self.values["channel_3"] = 0
-        self.values["channel_4"] = 0
-        self.values["channel_5"] = 0
-        self.values["mode"] = "manual"
-        self.values["led_on_off"] = False
+        self.updates: dict[str, list[Callable]] = {}
+        self.state = DeviceState()
+        self.schedule = Schedule()
+        self.schedule_complete = asyncio.Event()
+        self.restored: datetime | None = None
+        # Increased by every write, tells a running transition to stop
+        self.generation = 0
+        # Monotonic time of the last state report
+        self.reported: float | None = None
+        # State request shared by all callers of refresh
+        self.refreshing: asyncio.Future | None = None
+        # Last values reported by the device, the state shows pending writes
+        self.confirmed = self.state.as_dict()
+        # Written values waiting for confirmation and the write they belong to
+        self.pending: dict[str, tuple[Any, int]] = {}
+        self._writes = itertools.count()
+        # Latest write that has been sent to the device
+        self._sent = -1
+        self.attributes: dict[str, Attribute] = {
+            "connection": Attribute(is_on=False, extra=self.conn_info),
+            "mode": Attribute(options=MODES, default=self.state.mode),
+            "led_on_off": Attribute(is_on=False),
+        }
+        for attr in NUMBERS:
+            self.attributes[attr] = Attribute(
+                min=0, max=CHANNEL_MAX, step=50, value=0
+            )
+        for attr in SENSORS:
+            self.attributes[attr] = Attribute(value=None)
+        if advertisment:
+            self.update_ble(advertisment)
 
     @property
     def mac(self) -> str:
         """Expose the MAC address of the device."""
         return self.client.device.address
 
-    def update_ble(self, advertisment: AdvertisementData):
-        """Update BLE metadata."""
-        self.conn_info["last_seen"] = datetime.now(UTC)
-        self.conn_info["rssi"] = advertisment.rssi
+    @property
+    def available(self) -> bool:
+        """Return if the device is in range and not given up after failures."""
+        return self.present and not self.client.breaker.tripped
+
+    async def close(self):
+        """Disconnect from the device."""
+        await self.client.stop()
+
+    def update_ble(
+        self, advertisment: AdvertisementData, device: BLEDevice | None = None
+    ):
+        """Update BLE metadata, skipping updates without meaningful change.
+
+        A newer BLEDevice from the advertisement replaces the one used for
+        connecting.
+        """
+        if device:
+            self.client.device = device
+        self.set_present(True)
+        if self.client.breaker.tripped and self.client.breaker.allow():
+            # Seen again after giving up, try a single connection
+            self.client.ping()
+        now = datetime.now(UTC)
+        rssi = advertisment.rssi
+        if last_seen := self.conn_info.get("last_seen"):
+            elapsed = (now - last_seen).total_seconds()
+            if elapsed < MIN_UPDATE_INTERVAL:
+                return
+            if (
+                elapsed < LAST_SEEN_GRANULARITY
+                and abs(rssi - self.conn_info["rssi"]) < RSSI_HYSTERESIS
+            ):
+                return
 
-        for handler in self.updates_connect:
-            handler()
+        self.conn_info["last_seen"] = now
+        self.conn_info["rssi"] = rssi
+
+        self.dispatch(["connection"])
 
     def set_connected(self, connected: bool):
         """Set the connection status."""
+        if connected == self.connected:
+            return
         self.connected = connected
+        if connected:
+            self.set_present(True)
+
+        self.dispatch(["connection"])
+
+    def set_present(self, present: bool):
+        """Set if the device is in range and start the client once it is."""
+        if present == self.present:
+            return
+        self.present = present
+        if present:
+            self.client.start()
 
-        for handler in self.updates_connect:
-            handler()
+        self.dispatch_available()
+
+    def dispatch_available(self):
+        """Update every entity, all of them show the availability."""
+        self.dispatch(list(self.attributes))
 
     def numbers(self) -> list[str]:
         """List of numbers provided by the device."""
@@ -82,66 +247,391 @@ class Device:
         """List of select boxes provided by the device."""
         return list(SELECTS)
 
+    def sensors(self) -> list[str]:
+        """List of diagnostic sensors provided by the device."""
+        return list(SENSORS) if self.metrics.enabled else []
+
+    def diagnostics(self) -> dict:
+        """Return the state, link and timing information of the device."""
+        framer = self.client.framer
+        return {
+            "state": self.state.as_dict(),
+            "pending": {attr: value for attr, (value, _) in self.pending.items()},
+            "connection": {
+                "state": self.client.state,
+                "queued_commands": len(self.client.queue),
+                "frames": framer.frames,
+                "dropped_frames": framer.dropped,
+                **self.client.link_stats.as_dict(),
+            },
+            "breaker": self.client.breaker.as_dict(),
+            "schedule": self.schedule.as_list(),
+            "restored": self.restored,
+            "captured_packets": len(self.client.capture or ()),
+            "metrics": self.metrics.as_dict(),
+            "slots": self.client.manager.stats(),
+        }
+
+    def start_capture(self, records: int = DEFAULT_RECORDS) -> Capture:
+        """Start recording the packets exchanged with the device."""
+        self.client.capture = Capture(records)
+        return self.client.capture
+
+    def stop_capture(self) -> Capture | None:
+        """Stop recording and return the capture."""
+        capture, self.client.capture = self.client.capture, None
+        return capture
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return state, schedule and metadata as JSON serializable dictionary."""
+        last_seen = self.conn_info.get("last_seen")
+        return {
+            "saved": datetime.now(UTC).isoformat(),
+            "state": dict(self.confirmed),
+            "schedule": self.schedule.dump(),
+            "metadata": {
+                "name": self.name,
+                "address": self.mac,
+                "rssi": self.conn_info.get("rssi"),
+                "last_seen": last_seen.isoformat() if last_seen else None,
+            },
+        }
+
+    def restore(self, data: dict[str, Any]):
+        """Rehydrate the last known values from a snapshot.
+
+        Reports of the device overwrite the restored values as soon as it
+        reports in, values are not restored once it did. Metadata only fills
+        in what advertisements did not provide yet.
+        """
+        try:
+            saved = datetime.fromisoformat(data["saved"])
+            state = {
+                attr: value
+                for attr, value in data.get("state", {}).items()
+                if attr in DeviceState.__slots__
+            }
+            if state.get("mode", MODES[0]) not in MODES:
+                del state["mode"]
+            schedule = Schedule.load(data.get("schedule") or [])
+            metadata = data.get("metadata", {})
+            last_seen = metadata.get("last_seen")
+            if last_seen:
+                last_seen = datetime.fromisoformat(last_seen)
+        except (KeyError, TypeError, ValueError, IndexError) as e:
+            _LOGGER.warning("Ignoring invalid cache of %s: %s", self.name, e)
+            return
+
+        self.restored = saved
+        if self.reported is None:
+            self.confirmed.update(state)
+            self.update_values(
+                (attr, value)
+                for attr, value in state.items()
+                if attr not in self.pending
+            )
+        if not self.schedule.complete:
+            self.schedule = schedule
+            if schedule.complete:
+                self.schedule_complete.set()
+            self.dispatch(["schedule"])
+        rssi = metadata.get("rssi")
+        if last_seen and rssi is not None and "last_seen" not in self.conn_info:
+            self.conn_info["last_seen"] = last_seen
+            self.conn_info["rssi"] = rssi
+            self.dispatch(["connection"])
+
     def attribute(self, attr: str) -> Attribute:
-        """Provide attributes to the entities like switches, numbers etc."""
-        _LOGGER.debug("XXX -> attr: %s", attr)
-        if attr == "connection":
-            return Attribute(is_on=self.connected, extra=self.conn_info)
-        if attr.startswith("channel_"):
-            return Attribute(min=0, max=1000, step=50, value=self.values[attr])
-        if attr == "mode":
-            return Attribute(options=MODES, default=self.values[attr])
-        if attr == "led_on_off":
-            return Attribute(is_on=self.values[attr])
+        """Provide attributes to the entities like switches, numbers etc.
 
-    def register_update(self, attr: str, handler: Callable):
-        """Register handlers for updates."""
+        The returned attribute is shared and refreshed on every call, entities
+        must not keep or modify it.
+        """
+        if not (attribute := self.attributes.get(attr)):
+            return None
         if attr == "connection":
-            self.updates_connect.append(handler)
+            attribute["is_on"] = self.connected
+        elif metric := SENSORS.get(attr):
+            if attr.endswith("_latency"):
+                attribute["value"] = self.metrics.mean_ms(metric)
+            else:
+                attribute["value"] = self.metrics.counters.get(metric, 0)
+        elif "value" in attribute:
+            attribute["value"] = getattr(self.state, attr)
+        elif "default" in attribute:
+            attribute["default"] = getattr(self.state, attr)
         else:
-            self.updates_component.append(handler)
+            attribute["is_on"] = getattr(self.state, attr)
+        return attribute
+
+    def register_update(self, attr: str, handler: Callable):
+        """Register handlers for updates of a single attribute."""
+        self.updates.setdefault(attr, []).append(handler)
+
+    def dispatch(self, attrs: list[str]):
+        """Call the handlers registered for the given attributes."""
+        for attr in attrs:
+            for handler in self.updates.get(attr, ()):
+                handler()
 
-    def set_value(self, attr: str, value: int):
+    def update_values(self, values: Iterable[tuple[str, Any]]) -> list[str]:
+        """Merge new values and notify handlers of the changed attributes."""
+        changed = self.state.update(values)
+        self.dispatch(changed)
+        return changed
+
+    def set_value(self, attr: str, value: int) -> asyncio.Future:
         """Set values received by entities such as numbers and switches."""
-        _LOGGER.debug("Value %s changed to %s ", attr, str(value))
-        self.values[attr] = value
+        _LOGGER.debug("Value %s changed to %s ", attr, value)
+        return self.apply({attr: value})
 
-    def decode_update_packet(self, data: bytearray):
-        """Decode the received Fluval packet and sort into values."""
-        if data[2] == 0x00:
-            self.values["mode"] = MODES[0]
-        elif data[2] == 0x01:
-            self.values["mode"] = MODES[1]
-        elif data[2] == 0x02:
-            self.values["mode"] = MODES[2]
-
-        self.values["led_on_off"] = data[3] > 0x00
-
-        if self.values["mode"] == "manual":
-            self.values["channel_1"] = (data[6] << 8) | (data[5] & 0xFF)
-            self.values["channel_2"] = (data[8] << 8) | (data[7] & 0xFF)
-            self.values["channel_3"] = (data[10] << 8) | (data[9] & 0xFF)
-            self.values["channel_4"] = (data[12] << 8) | (data[11] & 0xFF)
+    def select_option(self, attr: str, option: str) -> asyncio.Future:
+        """Set the option chosen in a select box."""
+        return self.apply({attr: option})
+
+    def apply(self, values: dict[str, Any]) -> asyncio.Future:
+        """Write several attributes to the device in a single packet.
+
+        Values missing from the scene keep their current state. Consecutive
+        calls coalesce while waiting in the queue, so only the latest full
+        state is written. A running transition stops.
+        """
+        self.generation += 1
+        return self._write_state(values)
+
+    async def transition(self, values: dict[str, Any], duration: float) -> int:
+        """Fade the channels to new values within duration seconds.
+
+        Every frame is interpolated for the current time and written once
+        the previous one is done, so frames the link cannot keep up with are
+        skipped instead of queued. Values other than channels are written
+        with the first frame. Any other write stops the transition.
+        Returns the number of frames written.
+        """
+        self.generation += 1
+        generation = self.generation
+        targets = {attr: values[attr] for attr in NUMBERS if attr in values}
+        others = {k: v for k, v in values.items() if k not in targets}
+        begin = {attr: getattr(self.state, attr) for attr in targets}
+
+        start = time.monotonic()
+        frames = 0
+        last = None
+        while generation == self.generation:
+            now = time.monotonic()
+            progress = min((now - start) / duration, 1) if duration > 0 else 1
+            frame = {
+                attr: round(begin[attr] + (target - begin[attr]) * progress)
+                for attr, target in targets.items()
+            }
+            if frame != last:
+                await self._write_state({**others, **frame} if not frames else frame)
+                frames += 1
+                last = frame
+            if progress >= 1:
+                break
+            await asyncio.sleep(TRANSITION_INTERVAL - (time.monotonic() - now))
+        return frames
+
+    def _write_state(self, values: dict[str, Any]) -> asyncio.Future:
+        """Write values and show them until the device confirms or rejects them.
+
+        The values are pending until a state report matches them. They are
+        rolled back to the reported values if the write fails or no report
+        confirms them within CONFIRM_TIMEOUT after writing. The packet is
+        only encoded when it is written, from the reported state updated by
+        all pending values.
+        """
+        self.check_writes()
+        # Fail invalid values right away instead of when writing
+        self.encode_state(values)
+        write = next(self._writes)
+        for attr, value in values.items():
+            self.pending[attr] = (value, write)
+        future = self.client.send(self._state_packet, key="state")
+        self.update_values(values.items())
+        future.add_done_callback(lambda sent: self._state_sent(sent, write))
+        return future
+
+    def _state_packet(self) -> bytearray:
+        """Encode the set state command written for the pending values."""
+        return self.encode_state(
+            {attr: value for attr, (value, _) in self.pending.items()}
+        )
+
+    def _state_sent(self, sent: asyncio.Future, write: int):
+        """Roll back a failed write or wait for its confirmation."""
+        if sent.cancelled() or sent.exception():
+            self._rollback(write)
         else:
-            self.values["channel_1"] = 0
-            self.values["channel_2"] = 0
-            self.values["channel_3"] = 0
-            self.values["channel_4"] = 0
-
-        _LOGGER.debug(
-            "led: "
-            + str(self.values["led_on_off"])
-            + " mode: "
-            + str(self.values["mode"])
-            + " channels: "
-            + str(self.values["channel_1"])
-            + " / "
-            + str(self.values["channel_2"])
-            + " / "
-            + str(self.values["channel_3"])
-            + " / "
-            + str(self.values["channel_4"])
+            self._sent = max(self._sent, write)
+            asyncio.get_running_loop().call_later(
+                CONFIRM_TIMEOUT, self._rollback, write
+            )
+
+    def _rollback(self, write: int):
+        """Show the reported values again for those still pending from write."""
+        expired = [attr for attr, (_, w) in self.pending.items() if w == write]
+        if not expired:
+            return
+        for attr in expired:
+            del self.pending[attr]
+        _LOGGER.debug("%s: rolling back unconfirmed %s", self.name, expired)
+        self.metrics.count("rollbacks")
+        self.update_values((attr, self.confirmed[attr]) for attr in expired)
+
+    async def refresh(self, max_age: float = 0) -> DeviceState:
+        """Return the state, requesting it if it is older than max_age seconds.
+
+        Concurrent callers share a single state request.
+        """
+        if self.reported is not None and time.monotonic() - self.reported <= max_age:
+            return self.state
+
+        if not (refreshing := self.refreshing):
+            refreshing = self.refreshing = asyncio.get_running_loop().create_future()
+            sent = self.client.request_state()
+            sent.add_done_callback(self._refresh_sent)
+        try:
+            async with asyncio.timeout(REFRESH_TIMEOUT):
+                await asyncio.shield(refreshing)
+        except TimeoutError:
+            if self.refreshing is refreshing:
+                # Let the next caller ask again
+                self.refreshing = None
+            raise
+        return self.state
+
+    def _refresh_sent(self, sent: asyncio.Future):
+        """Fail the refresh if its state request could not be written."""
+        if not (refreshing := self.refreshing):
+            return
+        if sent.cancelled():
+            exc = ConnectionError("State request was cancelled")
+        elif not (exc := sent.exception()):
+            return
+        self.refreshing = None
+        refreshing.set_exception(exc)
+
+    async def sync_schedule(self, force: bool = False) -> Schedule:
+        """Download the professional mode schedule unless it is cached."""
+        if self.schedule.complete and not force:
+            return self.schedule
+        self.check_writes()
+        if force:
+            self.schedule = Schedule()
+            self.schedule_complete.clear()
+
+        self.client.send(
+            bytes([protocol.FRAME_MARKER, protocol.CMD_GET_SCHEDULE]),
+            key="get_schedule",
+        )
+        async with asyncio.timeout(SCHEDULE_TIMEOUT):
+            await self.schedule_complete.wait()
+        return self.schedule
+
+    async def upload_schedule(self, slots: list[ScheduleSlot]) -> int:
+        """Upload a schedule, writing only the slots that differ.
+
+        Returns the number of slots written.
+        """
+        self.check_writes()
+        schedule = await self.sync_schedule()
+        changes = schedule.diff(slots)
+        futures = [
+            self.client.send(encode_slot(index, slot), key=f"schedule_{index}")
+            for index, slot in changes
+        ]
+        await asyncio.gather(*futures)
+
+        for index, slot in changes:
+            schedule.update(index, slot)
+        if changes:
+            self.dispatch(["schedule"])
+        return len(changes)
+
+    def check_writes(self):
+        """Refuse commands with unverified layouts unless writes are enabled."""
+        if not self.writes:
+            raise WritesDisabledError(
+                f"Writing to {self.name} is not enabled, the commands are not "
+                "verified against the Fluval app yet"
+            )
+
+    def encode_state(self, values: dict[str, Any]) -> bytearray:
+        """Encode the reported state updated by values as set state command."""
+        state = self.confirmed
+        mode = values.get("mode", state["mode"])
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode}")
+        channels = [values.get(attr, state[attr]) for attr in NUMBERS]
+        for channel in channels:
+            if not 0 <= channel <= CHANNEL_MAX:
+                raise ValueError(f"Channel value {channel} out of range")
+        return protocol.STATE.pack(
+            protocol.CMD_SET_STATE,
+            MODES.index(mode),
+            bool(values.get("led_on_off", state["led_on_off"])),
+            *channels,
         )
 
-        for handler in self.updates_component:
-            handler()
+    def decode_update_packet(self, data: bytearray):
+        """Decode the received Fluval packet and sort into values."""
+        start = self.metrics.start()
+        self._decode(data)
+        self.metrics.stop("decode", start)
+
+    def _decode(self, data: bytearray):
+        layout = protocol.layout_for(data)
+        if len(data) < layout.size:
+            _LOGGER.debug("Ignoring short packet of %d bytes", len(data))
+            return
+        if layout is protocol.SCHEDULE_SLOT:
+            self._decode_schedule_slot(data)
+        elif layout is protocol.STATE:
+            self._decode_state(data)
+
+    def _decode_schedule_slot(self, data: bytearray):
+        index, slot = decode_slot(data)
+        if self.schedule.update(index, slot):
+            _LOGGER.debug("Schedule slot %d: %s", index, slot)
+            self.dispatch(["schedule"])
+        if self.schedule.complete:
+            self.schedule_complete.set()
+
+    def _decode_state(self, data: bytearray):
+        self.reported = time.monotonic()
+        if refreshing := self.refreshing:
+            self.refreshing = None
+            refreshing.set_result(None)
+
+        mode, led_on_off, *channels = protocol.STATE.unpack(data)
+        mode = MODES[mode] if mode < len(MODES) else self.confirmed["mode"]
+        reported = {"mode": mode, "led_on_off": led_on_off > 0x00}
+        if mode == "manual":
+            # Other modes do not report the channels, the last manual values
+            # are kept and written back when returning to manual mode
+            reported.update(zip(NUMBERS, channels))
+        self.confirmed.update(reported)
+
+        for attr, (value, write) in list(self.pending.items()):
+            if attr not in reported:
+                if write <= self._sent:
+                    # Not reported in this mode, the answer to the write is
+                    # all the confirmation there is
+                    del self.pending[attr]
+                    self.confirmed[attr] = value
+            elif reported[attr] == value:
+                del self.pending[attr]
+            else:
+                # The report may predate the write, keep showing the value
+                del reported[attr]
+        changed = self.update_values(reported.items())
+
+        if changed:
+            _LOGGER.debug(
+                "led: %s mode: %s channels: %s",
+                self.state.led_on_off,
+                self.state.mode,
+                channels,
+            )
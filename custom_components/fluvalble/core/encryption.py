@@ -1,30 +1,96 @@
-"""Encrypts/decrypts BLE packets for the fluval LED controller."""
+"""Encrypts/decrypts BLE packets for the fluval LED controller.
 
+Every packet starts with a three byte header. The XOR key of the payload is
+``header[0] ^ header[2]`` and ``header[0] ^ header[1]`` is the payload length
+plus one. The payload itself is XORed byte by byte with the key, which is done
+here with precomputed translation tables so that no Python level loop touches
+the individual bytes.
+"""
 
-def encrypt(source: bytearray) -> bytearray:
+from collections.abc import Iterable
+
+HEADER_SIZE = 3
+HEADER_MARKER = 0x54
+HEADER_KEY = 0x5A
+KEY = HEADER_MARKER ^ HEADER_KEY
+
+Buffer = bytes | bytearray | memoryview
+
+# One XOR translation table per possible key, usable with bytes.translate.
+TABLES = tuple(bytes(b ^ key for b in range(256)) for key in range(256))
+
+
+def _translatable(source: Buffer | Iterable[int]) -> bytes | bytearray:
+    """Return the source as an object supporting translate."""
+    if isinstance(source, (bytes, bytearray)):
+        return source
+    return bytes(source)
+
+
+def encrypt(source: Buffer | Iterable[int]) -> bytearray:
     """Encrypt a BLE packet for the Fluval LED controller."""
-    secret = (len(source) + 1) ^ 0x54
-    header = [0x54, secret, 0x5A]
-    encoded = bytearray(header)
-    for b in source:
-        encoded.append(b ^ 0xE)
-    return encoded
+    source = _translatable(source)
+    secret = (len(source) + 1) ^ HEADER_MARKER
+    # The header is stored pre-XORed, so translating the whole buffer in one
+    # go yields the plain header followed by the encrypted payload.
+    encoded = bytearray((HEADER_MARKER ^ KEY, secret ^ KEY, HEADER_KEY ^ KEY))
+    encoded += source
+    return encoded.translate(TABLES[KEY])
 
 
-def decrypt(source: bytearray | bytearray) -> bytes:
+def decrypt(source: Buffer) -> bytearray:
     """Decrypt a BLE packet from the Fluval LED controller."""
     key = source[0] ^ source[2]
-    length = len(source)
-    decrypted = bytearray()
-    for i in range(3, length):
-        decrypted.append(source[i] ^ key)
+    if isinstance(source, bytearray):
+        decrypted = source.translate(TABLES[key])
+    else:
+        decrypted = bytearray(source).translate(TABLES[key])
+    # Dropping the head of a bytearray only moves its start pointer.
+    del decrypted[:HEADER_SIZE]
     return decrypted
 
 
-def add_crc(source: bytearray) -> bytes:
-    """Calculate CRC for the packet."""
-    crc = 0x0
+def decrypt_into(source: Buffer, target: bytearray, offset: int = 0) -> int:
+    """Decrypt a BLE packet into a preallocated buffer.
+
+    Returns the number of payload bytes written at ``offset``.
+    """
+    # Slicing the header off a memoryview of the translated bytes costs more
+    # than translating into a bytearray and dropping its head.
+    decrypted = decrypt(source)
+    length = len(decrypted)
+    target[offset : offset + length] = decrypted
+    return length
+
+
+def payload_length(source: Buffer) -> int:
+    """Return the payload length announced by the packet header."""
+    return (source[0] ^ source[1]) - 1
+
+
+def encrypt_many(sources: Iterable[Buffer | Iterable[int]]) -> list[bytearray]:
+    """Encrypt several packets at once."""
+    _encrypt = encrypt
+    return [_encrypt(source) for source in sources]
+
+
+def decrypt_many(sources: Iterable[Buffer]) -> list[bytearray]:
+    """Decrypt several packets at once."""
+    _decrypt = decrypt
+    return [_decrypt(source) for source in sources]
+
+
+def crc(source: Buffer | Iterable[int]) -> int:
+    """Calculate the XOR checksum of a packet without modifying it."""
+    # A plain loop beats reduce and folding wide integers at frame sizes
+    checksum = 0x0
     for b in source:
-        crc = b ^ crc
-    source.append(crc)
-    return source
+        checksum ^= b
+    return checksum
+
+
+def add_crc(source: Buffer | Iterable[int]) -> bytearray:
+    """Return a copy of the packet with its checksum appended."""
+    packet = bytearray(source)
+    packet.append(crc(packet))
+    return packet
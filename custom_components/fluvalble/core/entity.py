@@ -1,10 +1,11 @@
 """Base entity of a Fluval BLE connected LED device for home assistant."""
 
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.device_registry import CONNECTION_NETWORK_MAC
 from homeassistant.helpers.entity import DeviceInfo, Entity
 
 from . import DOMAIN
-from .device import Device
+from .device import Device, WritesDisabledError
 
 
 class FluvalEntity(Entity):
@@ -33,6 +34,18 @@ class FluvalEntity(Entity):
 
         device.register_update(attr, self.internal_update)
 
+    @property
+    def available(self) -> bool:
+        """Return if the device is in range and the entity has a value."""
+        return self.device.available and super().available
+
+    def check_writes(self):
+        """Refuse actions unless writes are enabled in the options."""
+        try:
+            self.device.check_writes()
+        except WritesDisabledError as e:
+            raise HomeAssistantError(str(e)) from e
+
     def internal_update(self):
         """Provide a function for internal updates."""
         pass
@@ -0,0 +1,51 @@
+"""Run an operation on many Fluval devices in parallel."""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+import logging
+import time
+from typing import Any
+
+from .device import Device
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 10
+# Seconds a single device may take, including waiting for a connection slot
+DEFAULT_TIMEOUT = 60
+
+
+async def fan_out(
+    devices: Iterable[Device],
+    operation: Callable[[Device], Awaitable[Any]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> dict[str, dict[str, Any]]:
+    """Run an operation on every device, at most concurrency at a time.
+
+    Failures do not stop the other devices. Returns the success, latency,
+    error and result of each device by MAC address.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(device: Device) -> dict[str, Any]:
+        async with semaphore:
+            start = time.monotonic()
+            result = error = None
+            try:
+                async with asyncio.timeout(timeout):
+                    result = await operation(device)
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.warning("%s failed: %r", device.name, e)
+                error = str(e) or type(e).__name__
+            return {
+                "name": device.name,
+                "success": error is None,
+                "latency_ms": round((time.monotonic() - start) * 1000, 1),
+                "error": error,
+                "result": result,
+            }
+
+    devices = list(devices)
+    results = await asyncio.gather(*(run(device) for device in devices))
+    return {device.mac: result for device, result in zip(devices, results)}
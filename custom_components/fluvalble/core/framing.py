@@ -0,0 +1,127 @@
+"""Reassembles notification chunks sent by the Fluval into complete frames."""
+
+from collections.abc import Callable
+import logging
+import time
+
+from . import encryption
+from .protocol import FRAME_MARKER
+
+_LOGGER = logging.getLogger(__name__)
+
+# Payload bytes of a full notification, a shorter chunk ends the frame.
+CHUNK_SIZE = 17
+MAX_FRAME_SIZE = 512
+# Chunks of one frame arrive back to back, a longer gap means one got lost.
+FRAME_TIMEOUT = 2.0
+
+
+class FrameAssembler:
+    """Incrementally rebuild frames from encrypted notification chunks.
+
+    Chunks are decrypted straight into a preallocated buffer. Complete frames
+    are handed to the callback as a memoryview of that buffer, which is only
+    valid until the callback returns.
+
+    Message types with a known length complete as soon as that length is
+    reached, all frames end with a chunk shorter than CHUNK_SIZE. A chunk
+    starting with the frame marker and a known type begins a new frame, so
+    losing the last chunk of a frame drops only that frame.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[memoryview], None],
+        lengths: dict[int, int] | None = None,
+        size: int = MAX_FRAME_SIZE,
+        timeout: float = FRAME_TIMEOUT,
+    ) -> None:
+        """Initialize the assembler."""
+        self.callback = callback
+        self.lengths: dict[int, int] = dict(lengths or {})
+        self.timeout = timeout
+
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.position = 0
+        self.expected = 0
+        self.last_chunk = 0.0
+
+        self.frames = 0
+        self.dropped = 0
+
+    def register(self, message_type: int, length: int):
+        """Register the fixed frame length of a message type."""
+        self.lengths[message_type] = length
+
+    def reset(self):
+        """Forget the frame currently being assembled."""
+        self.position = 0
+        self.expected = 0
+
+    def feed(self, chunk: encryption.Buffer):
+        """Add an encrypted notification chunk."""
+        length = len(chunk) - encryption.HEADER_SIZE
+        if length < 0 or encryption.payload_length(chunk) != length:
+            _LOGGER.debug("Dropping frame, corrupt chunk")
+            self._drop()
+            return
+
+        now = time.monotonic()
+        if self.position and now - self.last_chunk > self.timeout:
+            _LOGGER.debug("Dropping frame, chunk timeout")
+            self._drop()
+        self.last_chunk = now
+
+        position = self.position
+        if position + length > len(self.buffer):
+            _LOGGER.debug("Dropping frame, too large")
+            self._drop()
+            return
+
+        encryption.decrypt_into(chunk, self.buffer, position)
+
+        if position and self._starts_frame(position, length):
+            _LOGGER.debug("Dropping frame, next frame started")
+            self.dropped += 1
+            self.buffer[:length] = bytes(self.view[position : position + length])
+            position = self.expected = 0
+
+        if position == 0 and self.buffer[0] != FRAME_MARKER:
+            # Tail of a frame whose start we missed, wait for the next one
+            self.dropped += 1
+            return
+
+        position += length
+        self.position = position
+
+        if not self.expected and position >= 2:
+            self.expected = self.lengths.get(self.buffer[1], 0)
+
+        expected = self.expected
+        if expected and position >= expected:
+            if position > expected:
+                _LOGGER.debug("Frame longer than the %d bytes of its type", expected)
+            self._emit(expected)
+        elif length < CHUNK_SIZE:
+            # Also ends frames shorter than the length of their type, a wrong
+            # length must not lose them
+            self._emit(position)
+
+    def _starts_frame(self, position: int, length: int) -> bool:
+        buffer = self.buffer
+        return (
+            length >= 2
+            and buffer[position] == FRAME_MARKER
+            and buffer[position + 1] in self.lengths
+        )
+
+    def _emit(self, length: int):
+        self.reset()
+        self.frames += 1
+        self.callback(self.view[:length])
+
+    def _drop(self):
+        if self.position:
+            self.dropped += 1
+        self.reset()
@@ -0,0 +1,128 @@
+"""Lightweight timing histograms and counters for the hot paths."""
+
+import bisect
+import time
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+
+
+class Histogram:
+    """Fixed bucket histogram of durations."""
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self) -> None:
+        """Initialize the histogram."""
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """Add a duration."""
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float | None:
+        """Return the upper bucket bound below which the quantile lies."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float | None:
+        """Return the mean duration."""
+        return self.total / self.count if self.count else None
+
+    def as_dict(self) -> dict:
+        """Return a summary in milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": _ms(self.mean),
+            "p50_ms": _ms(self.quantile(0.5)),
+            "p95_ms": _ms(self.quantile(0.95)),
+            "max_ms": _ms(self.max if self.count else None),
+        }
+
+
+class Metrics:
+    """Named histograms and counters that can be switched off.
+
+    Timing a section is done with start() and stop(). While disabled both
+    return right away without reading the clock.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        """Initialize the metrics."""
+        self.enabled = enabled
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+
+    def start(self) -> float:
+        """Return the start time of a timed section."""
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, name: str, start: float):
+        """Record the duration of a section started with start()."""
+        if self.enabled:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name: str, seconds: float):
+        """Record a duration."""
+        if not self.enabled:
+            return
+        if not (histogram := self.histograms.get(name)):
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def count(self, name: str, value: int = 1):
+        """Increase a counter."""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def mean_ms(self, name: str) -> float | None:
+        """Return the mean of a histogram in milliseconds."""
+        if histogram := self.histograms.get(name):
+            return _ms(histogram.mean)
+        return None
+
+    def as_dict(self) -> dict:
+        """Return all histograms and counters."""
+        return {
+            "enabled": self.enabled,
+            "timings": {
+                name: histogram.as_dict()
+                for name, histogram in self.histograms.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 3)
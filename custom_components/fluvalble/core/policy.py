@@ -0,0 +1,214 @@
+"""Policies deciding when the client keeps a link to the Fluval open."""
+
+import random
+import time
+
+MODE_ALWAYS = "always"
+MODE_ON_DEMAND = "on_demand"
+MODE_SCHEDULED = "scheduled"
+MODES = [MODE_ALWAYS, MODE_ON_DEMAND, MODE_SCHEDULED]
+
+# Commands in flight when pipelining is switched on in the options
+DEFAULT_PIPELINE_WINDOW = 4
+
+
+class ConnectionPolicy:
+    """Connection mode, heartbeat and reconnect settings of a client.
+
+    always: stay connected and reconnect after every loss.
+    on_demand: connect for commands, disconnect after idle_timeout.
+    scheduled: like on_demand, plus a sync window of sync_duration seconds
+    every sync_interval seconds to pick up state reports.
+
+    With a pipeline_window commands are written without response, up to that
+    many wait for their acknowledgement at once. Unacknowledged commands are
+    resent after ack_timeout seconds, at most max_retransmits times.
+
+    A connection attempt may take connect_timeout seconds and every GATT
+    operation gatt_timeout seconds. Failed GATT operations are retried up to
+    gatt_retries times after a jittered delay starting at retry_delay_min.
+    After breaker_threshold failed connections in a row the device is given
+    up for breaker_reset seconds, 0 never gives up.
+    """
+
+    def __init__(
+        self,
+        mode: str = MODE_ALWAYS,
+        idle_timeout: float = 120,
+        heartbeat_min: float = 10,
+        heartbeat_max: float = 60,
+        sync_interval: float = 3600,
+        sync_duration: float = 60,
+        backoff_min: float = 1,
+        backoff_max: float = 300,
+        pipeline_window: int = 0,
+        ack_timeout: float = 2,
+        max_retransmits: int = 2,
+        connect_timeout: float = 30,
+        gatt_timeout: float = 10,
+        gatt_retries: int = 2,
+        retry_delay_min: float = 0.25,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 300,
+    ) -> None:
+        """Initialize the policy."""
+        if mode not in MODES:
+            raise ValueError(f"Unknown connection mode {mode}")
+        self.mode = mode
+        self.idle_timeout = idle_timeout
+        self.heartbeat_min = heartbeat_min
+        self.heartbeat_max = heartbeat_max
+        self.sync_interval = sync_interval
+        self.sync_duration = sync_duration
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.pipeline_window = pipeline_window
+        self.ack_timeout = ack_timeout
+        self.max_retransmits = max_retransmits
+        self.connect_timeout = connect_timeout
+        self.gatt_timeout = gatt_timeout
+        self.gatt_retries = gatt_retries
+        self.retry_delay_min = retry_delay_min
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+
+    @property
+    def persistent(self) -> bool:
+        """Return if the link is kept open without activity."""
+        return self.mode == MODE_ALWAYS
+
+    @property
+    def pipelined(self) -> bool:
+        """Return if commands are written without response."""
+        return self.pipeline_window > 0
+
+    def heartbeat(self, idle: float) -> float:
+        """Return the keep-alive interval after being idle for some seconds.
+
+        The interval starts at heartbeat_min right after activity and doubles
+        the longer the link stays idle, up to heartbeat_max.
+        """
+        interval = self.heartbeat_min
+        while interval < self.heartbeat_max and idle >= interval * 2:
+            interval *= 2
+        return min(interval, self.heartbeat_max)
+
+    def backoff(self, failures: int) -> float:
+        """Return the delay before the next connection attempt."""
+        if failures <= 0:
+            return 0
+        delay = min(self.backoff_max, self.backoff_min * 2 ** (failures - 1))
+        # Jitter keeps a fleet from reconnecting in lockstep
+        return random.uniform(delay / 2, delay)
+
+    def retry_delay(self, attempt: int) -> float:
+        """Return the delay before retrying a failed GATT operation."""
+        delay = self.retry_delay_min * 2 ** (attempt - 1)
+        return random.uniform(delay / 2, delay)
+
+    def next_sync(self, now: float | None = None) -> float | None:
+        """Return the seconds until the next sync window opens."""
+        if self.mode != MODE_SCHEDULED:
+            return None
+        now = time.time() if now is None else now
+        return self.sync_interval - now % self.sync_interval
+
+
+class CircuitBreaker:
+    """Give up on a device after too many failed connections in a row.
+
+    Once tripped no connection is attempted for reset seconds. Then a single
+    attempt is let through, its success closes the breaker again and its
+    failure keeps it open for another reset seconds.
+    """
+
+    __slots__ = ("threshold", "reset", "failures", "trips", "opened")
+
+    def __init__(self, threshold: int, reset: float) -> None:
+        """Initialize the breaker, a threshold of 0 never trips."""
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.trips = 0
+        self.opened = 0.0
+
+    @property
+    def tripped(self) -> bool:
+        """Return if the device has been given up."""
+        return 0 < self.threshold <= self.failures
+
+    def remaining(self) -> float:
+        """Return the seconds until the next attempt is allowed."""
+        if not self.tripped:
+            return 0
+        return max(self.opened + self.reset - time.monotonic(), 0)
+
+    def allow(self) -> bool:
+        """Return if a connection may be attempted."""
+        return self.remaining() <= 0
+
+    def success(self) -> bool:
+        """Record a working connection, return if that closed the breaker."""
+        tripped = self.tripped
+        self.failures = 0
+        return tripped
+
+    def failure(self) -> bool:
+        """Record a failed connection, return if that tripped the breaker."""
+        tripped = self.tripped
+        self.failures += 1
+        if self.tripped:
+            self.opened = time.monotonic()
+            if not tripped:
+                self.trips += 1
+                return True
+        return False
+
+    def as_dict(self) -> dict:
+        """Return the state of the breaker."""
+        return {
+            "tripped": self.tripped,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "retry_in": round(self.remaining(), 1),
+        }
+
+
+class LinkStats:
+    """Counters of how much time a client spends connected."""
+
+    __slots__ = ("created", "connects", "failures", "connected_time", "_since")
+
+    def __init__(self) -> None:
+        """Initialize the counters."""
+        self.created = time.monotonic()
+        self.connects = 0
+        self.failures = 0
+        self.connected_time = 0.0
+        self._since: float | None = None
+
+    def connected(self):
+        """Record a new connection."""
+        self.connects += 1
+        self._since = time.monotonic()
+
+    def disconnected(self, failed: bool = False):
+        """Record the end of a connection or a failed attempt."""
+        if failed:
+            self.failures += 1
+        if self._since is not None:
+            self.connected_time += time.monotonic() - self._since
+            self._since = None
+
+    def as_dict(self) -> dict:
+        """Return the counters including the current connection."""
+        now = time.monotonic()
+        connected_time = self.connected_time
+        if self._since is not None:
+            connected_time += now - self._since
+        return {
+            "connects": self.connects,
+            "failures": self.failures,
+            "connected_time": round(connected_time, 1),
+            "connected_ratio": round(connected_time / max(now - self.created, 1), 3),
+        }
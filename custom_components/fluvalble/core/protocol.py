@@ -0,0 +1,129 @@
+"""Layouts of the frames exchanged with the Fluval LED controller."""
+
+from collections.abc import Iterator
+import struct
+
+from .encryption import Buffer
+
+# First byte of every frame, the second one is the message type.
+FRAME_MARKER = 0x68
+
+# Requests a state report, also sent as handshake after connecting
+CMD_STATE = 0x05
+# UNVERIFIED ASSUMPTION: sets mode, power and all channels at once, laid out
+# like a state report. Neither the type byte nor the layout has been checked
+# against a capture of the Fluval app yet, confirm both with a bluetooth
+# snoop log of the app and the start_capture service before relying on them.
+CMD_SET_STATE = 0x04
+# UNVERIFIED ASSUMPTION: the schedule type bytes below and SCHEDULE_SLOT have
+# not been checked against a capture of the Fluval app yet, confirm them the
+# same way as CMD_SET_STATE before relying on them.
+# Requests all slots of the professional mode schedule
+CMD_GET_SCHEDULE = 0x06
+# One slot of the professional mode schedule, sent in both directions
+CMD_SCHEDULE_SLOT = 0x07
+
+
+class Layout:
+    """Precompiled struct layout of a message type.
+
+    Every name belongs to one value of the struct format, bytes that are not
+    decoded are skipped with pad bytes in the format.
+    """
+
+    __slots__ = ("struct", "names", "size")
+
+    def __init__(self, fmt: str, names: tuple[str, ...]) -> None:
+        """Initialize the layout."""
+        self.struct = struct.Struct(fmt)
+        self.names = names
+        self.size = self.struct.size
+        if len(self.struct.unpack(bytes(self.size))) != len(names):
+            raise ValueError(f"Layout {fmt} does not match {names}")
+
+    def unpack(self, data: Buffer) -> tuple:
+        """Decode the raw values of a frame."""
+        return self.struct.unpack_from(data)
+
+    def items(self, data: Buffer) -> Iterator[tuple[str, int]]:
+        """Decode a frame into pairs of name and raw value."""
+        return zip(self.names, self.struct.unpack_from(data))
+
+    def pack(self, message_type: int, *values: int) -> bytearray:
+        """Encode raw values into a frame of the given message type."""
+        frame = bytearray(self.struct.pack(*values))
+        frame[0] = FRAME_MARKER
+        frame[1] = message_type
+        return frame
+
+
+# marker, type, mode, led on/off, unknown, five little endian channel values
+STATE = Layout(
+    "<2xBBx5H",
+    (
+        "mode",
+        "led_on_off",
+        "channel_1",
+        "channel_2",
+        "channel_3",
+        "channel_4",
+        "channel_5",
+    ),
+)
+
+# marker, type, slot index, hour, minute, five little endian channel values.
+# UNVERIFIED ASSUMPTION, see CMD_SCHEDULE_SLOT.
+SCHEDULE_SLOT = Layout(
+    "<2xBBB5H",
+    (
+        "index",
+        "hour",
+        "minute",
+        "channel_1",
+        "channel_2",
+        "channel_3",
+        "channel_4",
+        "channel_5",
+    ),
+)
+
+# Layouts of other message types by type byte
+LAYOUTS: dict[int, Layout] = {
+    CMD_SCHEDULE_SLOT: SCHEDULE_SLOT,
+}
+
+# Lengths of the frames sent by the Fluval by type byte, they complete as soon
+# as the length is reached and a chunk starting with one of these types
+# begins a new frame. Like layout_for, only types with their own layout are
+# known. The type byte and length of state reports are not, they end with a
+# chunk shorter than a full one.
+FRAME_LENGTHS: dict[int, int] = {
+    message_type: layout.size for message_type, layout in LAYOUTS.items()
+}
+
+
+def answers(report: Buffer, packet: Buffer) -> bool:
+    """Return if a state report can be the answer to a written packet.
+
+    Set state commands are only answered by a report showing their values,
+    channels only count in manual mode as others do not report them. Any
+    report answers other packets.
+    """
+    if len(packet) < STATE.size or packet[1] != CMD_SET_STATE:
+        return True
+    mode, led_on_off, *channels = STATE.unpack(packet)
+    reported_mode, reported_led, *reported_channels = STATE.unpack(report)
+    return (
+        mode == reported_mode
+        and bool(led_on_off) == bool(reported_led)
+        and (mode != 0 or channels == reported_channels)
+    )
+
+
+def layout_for(data: Buffer) -> Layout:
+    """Return the layout of a frame.
+
+    The type byte of state reports is not known, so every frame of a type
+    without its own layout is decoded as state report.
+    """
+    return LAYOUTS.get(data[1], STATE)
@@ -0,0 +1,105 @@
+"""Professional mode schedule of a Fluval LED device."""
+
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from . import protocol
+from .encryption import Buffer
+
+# Number of slots the device stores
+SLOTS = 8
+# Hour value marking an unused slot
+EMPTY_HOUR = 0xFF
+
+
+class ScheduleSlot(NamedTuple):
+    """Channel values the device fades to at a time of day."""
+
+    hour: int
+    minute: int
+    channels: tuple[int, int, int, int, int]
+
+    @property
+    def empty(self) -> bool:
+        """Return if the slot is unused."""
+        return self.hour == EMPTY_HOUR
+
+
+EMPTY_SLOT = ScheduleSlot(EMPTY_HOUR, 0, (0, 0, 0, 0, 0))
+
+
+class Schedule:
+    """Cached copy of the schedule stored on the device."""
+
+    def __init__(self, slots: Iterable[ScheduleSlot | None] | None = None) -> None:
+        """Initialize the schedule, slots that are None are not known yet."""
+        self.slots: list[ScheduleSlot | None] = [None] * SLOTS
+        if slots is not None:
+            for index, slot in enumerate(slots):
+                self.slots[index] = slot
+
+    @property
+    def complete(self) -> bool:
+        """Return if every slot is known."""
+        return None not in self.slots
+
+    def update(self, index: int, slot: ScheduleSlot) -> bool:
+        """Store a slot reported by the device, returns if it changed."""
+        if not 0 <= index < SLOTS or self.slots[index] == slot:
+            return False
+        self.slots[index] = slot
+        return True
+
+    def diff(self, slots: Iterable[ScheduleSlot]) -> list[tuple[int, ScheduleSlot]]:
+        """Return the slots of a new program that differ from this schedule.
+
+        Slots beyond the end of the program are cleared.
+        """
+        program = list(slots)
+        if len(program) > SLOTS:
+            raise ValueError(f"A schedule has at most {SLOTS} slots")
+        program += [EMPTY_SLOT] * (SLOTS - len(program))
+        return [
+            (index, slot)
+            for index, slot in enumerate(program)
+            if self.slots[index] != slot
+        ]
+
+    def dump(self) -> list[list | None]:
+        """Return every slot as JSON serializable list, unknown slots as None."""
+        return [
+            None if slot is None else [slot.hour, slot.minute, list(slot.channels)]
+            for slot in self.slots
+        ]
+
+    @classmethod
+    def load(cls, data: list[list | None]) -> "Schedule":
+        """Create a schedule from the output of dump()."""
+        return cls(
+            None if slot is None else ScheduleSlot(slot[0], slot[1], tuple(slot[2]))
+            for slot in data[:SLOTS]
+        )
+
+    def as_list(self) -> list[dict]:
+        """Return the used slots as list of dictionaries."""
+        return [
+            {
+                "time": f"{slot.hour:02d}:{slot.minute:02d}",
+                "channels": list(slot.channels),
+            }
+            for slot in self.slots
+            if slot and not slot.empty
+        ]
+
+
+def decode_slot(data: Buffer) -> tuple[int, ScheduleSlot]:
+    """Decode a schedule slot frame into its index and slot."""
+    index, hour, minute, *channels = protocol.SCHEDULE_SLOT.unpack(data)
+    return index, ScheduleSlot(hour, minute, tuple(channels))
+
+
+def encode_slot(index: int, slot: ScheduleSlot) -> bytearray:
+    """Encode a schedule slot for upload."""
+    return protocol.SCHEDULE_SLOT.pack(
+        protocol.CMD_SCHEDULE_SLOT, index, slot.hour, slot.minute, *slot.channels
+    )
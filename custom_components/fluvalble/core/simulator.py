@@ -0,0 +1,248 @@
+"""In-process simulation of a Fluval LED controller for offline testing.
+
+A SimulatedFluval speaks the encrypted protocol of core/encryption.py on the
+characteristics 00001001 (handshake), 00001002 (commands and notifications)
+and 00001004 (keep-alive). Pass its establish_connection to Client or Device
+as connector to use it instead of a real tank.
+"""
+
+import asyncio
+from collections.abc import Callable
+import logging
+import random
+
+from bleak import AdvertisementData, BleakError, BLEDevice
+
+from . import encryption, protocol
+from .framing import CHUNK_SIZE
+from .schedule import EMPTY_SLOT, SLOTS, decode_slot, encode_slot
+
+_LOGGER = logging.getLogger(__name__)
+
+UUID_HANDSHAKE = "00001001-0000-1000-8000-00805f9b34fb"
+UUID_DATA = "00001002-0000-1000-8000-00805f9b34fb"
+UUID_KEEPALIVE = "00001004-0000-1000-8000-00805f9b34fb"
+# State reports are padded after the channels up to this length, the length
+# of the reports of a real Fluval is not known
+REPORT_SIZE = 40
+
+
+class SimulatedFluval:
+    """A simulated Fluval LED controller.
+
+    latency: seconds every GATT operation and notification takes
+    loss: probability that a notification chunk gets lost
+    disconnect_rate: probability that an operation drops the link
+    chunk_size: payload bytes per notification
+    """
+
+    def __init__(
+        self,
+        address: str = "00:00:00:00:00:00",
+        name: str = "Fluval",
+        latency: float = 0.0,
+        loss: float = 0.0,
+        disconnect_rate: float = 0.0,
+        chunk_size: int = CHUNK_SIZE,
+        seed: int | None = None,
+    ) -> None:
+        """Initialize the simulated device."""
+        self.address = address
+        self.name = name
+        self.latency = latency
+        self.loss = loss
+        self.disconnect_rate = disconnect_rate
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+
+        self.mode = 0
+        self.led_on_off = 1
+        self.channels = [0, 0, 0, 0, 0]
+        self.schedule = [EMPTY_SLOT] * SLOTS
+
+        # Handlers of commands written to the data characteristic by type
+        self.handlers: dict[int, Callable[[bytearray], None]] = {
+            protocol.CMD_SET_STATE: self.set_state,
+            protocol.CMD_GET_SCHEDULE: self.send_schedule,
+            protocol.CMD_SCHEDULE_SLOT: self.set_schedule_slot,
+        }
+
+        self.client: SimulatedClient | None = None
+        self.connects = 0
+        self.writes = 0
+        self.notifications = 0
+        self.lost = 0
+
+    @property
+    def device(self) -> BLEDevice:
+        """Return a BLEDevice describing the simulated device."""
+        return BLEDevice(self.address, self.name, {"source": "simulator"})
+
+    def advertisement(self, rssi: int = -60) -> AdvertisementData:
+        """Return advertisement data of the simulated device."""
+        return AdvertisementData(
+            local_name=self.name,
+            manufacturer_data={},
+            service_data={},
+            service_uuids=[],
+            tx_power=None,
+            rssi=rssi,
+            platform_data=(),
+        )
+
+    async def establish_connection(
+        self,
+        client_class: type,
+        device: BLEDevice,
+        name: str,
+        disconnected_callback: Callable | None = None,
+        **kwargs,
+    ) -> "SimulatedClient":
+        """Connect to the simulated device, like bleak_retry_connector does."""
+        await self.sleep()
+        if self.client and self.client.is_connected:
+            await self.client.disconnect()
+        self.connects += 1
+        self.client = SimulatedClient(self, disconnected_callback)
+        return self.client
+
+    async def sleep(self):
+        """Wait for the configured link latency."""
+        await asyncio.sleep(self.latency)
+
+    def report(self) -> bytearray:
+        """Return a state report frame."""
+        frame = protocol.STATE.pack(
+            protocol.CMD_STATE, self.mode, self.led_on_off, *self.channels
+        )
+        frame.extend(bytes(REPORT_SIZE - len(frame)))
+        return frame
+
+    def set_state(self, payload: bytearray):
+        """Apply a set state command."""
+        if len(payload) < protocol.STATE.size:
+            return
+        self.mode, self.led_on_off, *self.channels = protocol.STATE.unpack(payload)
+
+    def send_schedule(self, payload: bytearray):
+        """Report every slot of the schedule."""
+        for index, slot in enumerate(self.schedule):
+            self.notify(encode_slot(index, slot))
+
+    def set_schedule_slot(self, payload: bytearray):
+        """Store an uploaded schedule slot."""
+        if len(payload) < protocol.SCHEDULE_SLOT.size:
+            return
+        index, slot = decode_slot(payload)
+        if 0 <= index < SLOTS:
+            self.schedule[index] = slot
+
+    def write(self, uuid: str, data: bytes):
+        """Handle a packet written by the central."""
+        self.writes += 1
+        packet = encryption.decrypt(data)
+        if len(packet) < 3 or encryption.crc(packet[:-1]) != packet[-1]:
+            _LOGGER.debug("Simulator ignoring packet with bad checksum")
+            return
+        payload = packet[:-1]
+        if payload[0] != protocol.FRAME_MARKER:
+            return
+        if uuid == UUID_HANDSHAKE:
+            # The handshake is the only known state request
+            if payload[1] != protocol.CMD_STATE:
+                return
+        elif handler := self.handlers.get(payload[1]):
+            handler(payload)
+        else:
+            return
+        # Every accepted packet is answered with the current state
+        self.notify(self.report())
+
+    def notify(self, frame: bytes):
+        """Send a frame to the subscribed central in encrypted chunks."""
+        if not self.client or not self.client.callback:
+            return
+        loop = asyncio.get_running_loop()
+        for i in range(0, len(frame), self.chunk_size):
+            self.notifications += 1
+            if self.loss and self.random.random() < self.loss:
+                self.lost += 1
+                continue
+            chunk = encryption.encrypt(frame[i : i + self.chunk_size])
+            loop.call_later(self.latency, self.client.deliver, chunk)
+
+
+class SimulatedClient:
+    """Drop-in replacement of BleakClient talking to a SimulatedFluval."""
+
+    def __init__(
+        self, peripheral: SimulatedFluval, disconnected_callback: Callable | None
+    ) -> None:
+        """Initialize the client."""
+        self.peripheral = peripheral
+        self.disconnected_callback = disconnected_callback
+        self.callback: Callable | None = None
+        self.connected = True
+
+    @property
+    def is_connected(self) -> bool:
+        """Return if the simulated link is up."""
+        return self.connected
+
+    async def read_gatt_char(self, char: str) -> bytearray:
+        """Read a characteristic."""
+        await self._operation()
+        if char.lower() != UUID_KEEPALIVE:
+            raise BleakError(f"Characteristic {char} not readable")
+        return bytearray(b"\x00")
+
+    async def write_gatt_char(self, char: str, data: bytes, response: bool = False):
+        """Write a characteristic.
+
+        Writes without response do not wait for a round trip.
+        """
+        await self._operation(response)
+        uuid = char.lower()
+        if uuid not in (UUID_HANDSHAKE, UUID_DATA):
+            raise BleakError(f"Characteristic {char} not writable")
+        self.peripheral.write(uuid, bytes(data))
+
+    async def start_notify(self, char: str, callback: Callable):
+        """Subscribe to notifications."""
+        await self._operation()
+        self.callback = callback
+
+    async def stop_notify(self, char: str):
+        """Unsubscribe from notifications."""
+        self.callback = None
+
+    async def disconnect(self) -> bool:
+        """Close the simulated link."""
+        self._drop()
+        return True
+
+    def deliver(self, chunk: bytearray):
+        """Pass a notification chunk to the subscriber."""
+        if self.connected and self.callback:
+            self.callback(None, chunk)
+
+    async def _operation(self, round_trip: bool = True):
+        if not self.connected:
+            raise BleakError("Not connected")
+        if round_trip:
+            await self.peripheral.sleep()
+        else:
+            await asyncio.sleep(0)
+        rate = self.peripheral.disconnect_rate
+        if rate and self.peripheral.random.random() < rate:
+            self._drop()
+        if not self.connected:
+            raise BleakError("Disconnected")
+
+    def _drop(self):
+        if not self.connected:
+            return
+        self.connected = False
+        self.callback = None
+        if self.disconnected_callback:
+            self.disconnected_callback(self)
@@ -0,0 +1,26 @@
+"""Diagnostics support for the Fluval Aquarium LED integration."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_MAC
+from homeassistant.core import HomeAssistant
+
+from .core import DOMAIN
+
+# The MAC is also part of the entry title and its unique id
+TO_REDACT = {CONF_MAC, "title", "unique_id"}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    data: dict[str, Any] = {
+        "entry": async_redact_data(entry.as_dict(), TO_REDACT),
+    }
+    if device := hass.data.get(DOMAIN, {}).get(entry.entry_id):
+        data["device"] = device.diagnostics()
+    return data
@@ -28,6 +28,6 @@ class FluvalNumber(FluvalEntity, NumberEntity):
             self._async_write_ha_state()
 
     async def async_set_native_value(self, value: float) -> None:
+        self.check_writes()
+        # The device shows the value right away and rolls it back if needed
         self.device.set_value(self.attr, int(value))
-        self._attr_native_value = int(value)
-        self._async_write_ha_state()
@@ -27,6 +27,5 @@ class FluvalSelect(FluvalEntity, SelectEntity):
             self._async_write_ha_state()
 
     async def async_select_option(self, option: str) -> None:
+        self.check_writes()
         self.device.select_option(self.attr, option)
-        self._attr_current_option = option
-        self._async_write_ha_state()
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import EntityCategory, UnitOfTime
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .core import DOMAIN
+from .core.entity import FluvalEntity
+
+# Metrics change with every packet, poll them instead of pushing updates
+SCAN_INTERVAL = timedelta(seconds=60)
+
+
+async def async_setup_entry(
+    hass: HomeAssistant, config_entry: ConfigEntry, add_entities: AddEntitiesCallback
+):
+    device = hass.data[DOMAIN][config_entry.entry_id]
+
+    add_entities([FluvalMetricSensor(device, sensor) for sensor in device.sensors()])
+
+
+class FluvalMetricSensor(FluvalEntity, SensorEntity):
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+    _attr_should_poll = True
+
+    def __init__(self, device, attr: str) -> None:
+        if attr.endswith("_latency"):
+            self._attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+        else:
+            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+        super().__init__(device, attr)
+
+    def internal_update(self):
+        attribute = self.device.attribute(self.attr)
+        if not attribute:
+            return
+
+        self._attr_native_value = attribute.get("value")
+
+    async def async_update(self) -> None:
+        self.internal_update()
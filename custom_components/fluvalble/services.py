@@ -0,0 +1,248 @@
+"""Services of the Fluval Aquarium LED integration."""
+from __future__ import annotations
+
+import logging
+import time
+
+import voluptuous as vol
+
+from homeassistant.const import ATTR_DEVICE_ID
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+)
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv, device_registry as dr
+
+from .core import DOMAIN
+from .core.capture import DEFAULT_RECORDS
+from .core.device import CHANNEL_MAX, MODES, NUMBERS, Device
+from .core.fleet import DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, fan_out
+from .core.schedule import SLOTS, ScheduleSlot
+
+_LOGGER = logging.getLogger(__name__)
+
+SERVICE_SET_SCENE = "set_scene"
+SERVICE_SET_SCHEDULE = "set_schedule"
+SERVICE_TRANSITION = "transition"
+SERVICE_REFRESH = "refresh"
+SERVICE_START_CAPTURE = "start_capture"
+SERVICE_STOP_CAPTURE = "stop_capture"
+
+ATTR_CONCURRENCY = "concurrency"
+ATTR_TIMEOUT = "timeout"
+ATTR_DURATION = "duration"
+ATTR_RECORDS = "records"
+ATTR_MAX_AGE = "max_age"
+
+CHANNEL = vol.All(vol.Coerce(int), vol.Range(min=0, max=CHANNEL_MAX))
+
+SCENE_FIELDS = {
+    vol.Optional("mode"): vol.In(MODES),
+    vol.Optional("led_on_off"): cv.boolean,
+    **{vol.Optional(attr): CHANNEL for attr in NUMBERS},
+}
+SCENE_KEYS = {str(key) for key in SCENE_FIELDS}
+
+# Target devices and how many of them are written in parallel
+GROUP_FIELDS = {
+    vol.Required(ATTR_DEVICE_ID): vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional(ATTR_CONCURRENCY, default=DEFAULT_CONCURRENCY): vol.All(
+        vol.Coerce(int), vol.Range(min=1)
+    ),
+    vol.Optional(ATTR_TIMEOUT, default=DEFAULT_TIMEOUT): vol.All(
+        vol.Coerce(float), vol.Range(min=1)
+    ),
+}
+
+SET_SCENE_SCHEMA = vol.Schema(GROUP_FIELDS).extend(SCENE_FIELDS)
+
+TRANSITION_SCHEMA = (
+    vol.Schema(GROUP_FIELDS)
+    .extend(SCENE_FIELDS)
+    .extend(
+        {
+            vol.Required(ATTR_DURATION): vol.All(
+                vol.Coerce(float), vol.Range(min=0, max=86400)
+            )
+        }
+    )
+)
+
+SLOT_SCHEMA = vol.Schema(
+    {
+        vol.Required("time"): cv.time,
+        vol.Required("channels"): vol.All(
+            cv.ensure_list, vol.Length(min=5, max=5), [CHANNEL]
+        ),
+    }
+)
+
+SET_SCHEDULE_SCHEMA = vol.Schema(GROUP_FIELDS).extend(
+    {
+        vol.Required("slots"): vol.All(
+            cv.ensure_list, vol.Length(max=SLOTS), [SLOT_SCHEMA]
+        ),
+    }
+)
+
+DEVICES_SCHEMA = vol.Schema(
+    {vol.Required(ATTR_DEVICE_ID): vol.All(cv.ensure_list, [cv.string])}
+)
+
+REFRESH_SCHEMA = vol.Schema(GROUP_FIELDS).extend(
+    {
+        vol.Optional(ATTR_MAX_AGE, default=0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        )
+    }
+)
+
+START_CAPTURE_SCHEMA = DEVICES_SCHEMA.extend(
+    {
+        vol.Optional(ATTR_RECORDS, default=DEFAULT_RECORDS): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=1_000_000)
+        )
+    }
+)
+
+
+def resolve_devices(hass: HomeAssistant, device_ids: list[str]) -> list[Device]:
+    """Find the Fluval devices belonging to Home Assistant device ids."""
+    registry = dr.async_get(hass)
+    devices = {device.mac: device for device in hass.data.get(DOMAIN, {}).values()}
+    found = []
+    for device_id in device_ids:
+        if not (entry := registry.async_get(device_id)):
+            raise HomeAssistantError(f"Unknown device {device_id}")
+        for domain, mac in entry.identifiers:
+            if domain == DOMAIN and (device := devices.get(mac)):
+                found.append(device)
+                break
+        else:
+            raise HomeAssistantError(f"Device {device_id} is not a connected Fluval")
+    return found
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the services of the integration."""
+
+    async def run(call: ServiceCall, operation, duration: float = 0) -> ServiceResponse:
+        """Run an operation on the devices of a call, bounded in parallel."""
+        devices = resolve_devices(hass, call.data[ATTR_DEVICE_ID])
+        start = time.monotonic()
+        results = await fan_out(
+            devices,
+            operation,
+            call.data[ATTR_CONCURRENCY],
+            call.data[ATTR_TIMEOUT] + duration,
+        )
+        elapsed = time.monotonic() - start
+        succeeded = sum(result["success"] for result in results.values())
+        _LOGGER.debug(
+            "%s: %d of %d devices in %.3fs",
+            call.service,
+            succeeded,
+            len(results),
+            elapsed,
+        )
+        return {
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "devices": results,
+        }
+
+    async def set_scene(call: ServiceCall) -> ServiceResponse:
+        """Write mode, power and channels of each device in a single packet."""
+        values = {k: v for k, v in call.data.items() if k in SCENE_KEYS}
+        return await run(call, lambda device: device.apply(values))
+
+    async def transition(call: ServiceCall) -> ServiceResponse:
+        """Fade the channels to new values over a duration."""
+        values = {k: v for k, v in call.data.items() if k in SCENE_KEYS}
+        duration = call.data[ATTR_DURATION]
+        return await run(
+            call, lambda device: device.transition(values, duration), duration
+        )
+
+    async def set_schedule(call: ServiceCall) -> ServiceResponse:
+        """Upload a professional mode program, only writing changed slots."""
+        slots = [
+            ScheduleSlot(
+                slot["time"].hour, slot["time"].minute, tuple(slot["channels"])
+            )
+            for slot in sorted(call.data["slots"], key=lambda slot: slot["time"])
+        ]
+        return await run(call, lambda device: device.upload_schedule(slots))
+
+    async def refresh(call: ServiceCall) -> ServiceResponse:
+        """Return the state of the devices, requesting it when too old."""
+        max_age = call.data[ATTR_MAX_AGE]
+
+        async def state(device: Device) -> dict:
+            return (await device.refresh(max_age)).as_dict()
+
+        return await run(call, state)
+
+    async def start_capture(call: ServiceCall) -> None:
+        """Record the packets exchanged with the devices."""
+        for device in resolve_devices(hass, call.data[ATTR_DEVICE_ID]):
+            device.start_capture(call.data[ATTR_RECORDS])
+
+    async def stop_capture(call: ServiceCall) -> ServiceResponse:
+        """Stop recording and save the captures to the config directory."""
+        files = {}
+        stamp = time.strftime("%Y%m%d%H%M%S")
+        for device in resolve_devices(hass, call.data[ATTR_DEVICE_ID]):
+            if (capture := device.stop_capture()) is None:
+                continue
+            name = f"{DOMAIN}_{device.mac.replace(':', '')}_{stamp}.cap"
+            path = hass.config.path(name)
+            await hass.async_add_executor_job(capture.save, path)
+            _LOGGER.info(
+                "Saved %d packets of %s to %s", len(capture), device.name, path
+            )
+            files[device.mac] = path
+        return {"files": files}
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SET_SCENE,
+        set_scene,
+        schema=SET_SCENE_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_TRANSITION,
+        transition,
+        schema=TRANSITION_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SET_SCHEDULE,
+        set_schedule,
+        schema=SET_SCHEDULE_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_REFRESH,
+        refresh,
+        schema=REFRESH_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_START_CAPTURE, start_capture, schema=START_CAPTURE_SCHEMA
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_STOP_CAPTURE,
+        stop_capture,
+        schema=DEVICES_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
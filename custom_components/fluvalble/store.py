@@ -0,0 +1,53 @@
+"""Persistent cache of the last known state of Fluval devices."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from .core import DOMAIN
+from .core.device import Device, DeviceState
+
+STORAGE_VERSION = 1
+# Seconds to collect changes before writing the cache
+SAVE_DELAY = 10
+
+
+class DeviceCache:
+    """Keep the snapshot of a device in Home Assistant storage."""
+
+    def __init__(self, hass: HomeAssistant, entry_id: str) -> None:
+        """Initialize the cache of a config entry."""
+        self.store: Store[dict[str, Any]] = Store(
+            hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}"
+        )
+        self.device: Device | None = None
+
+    async def async_load(self) -> dict[str, Any] | None:
+        """Return the stored snapshot, if any."""
+        return await self.store.async_load()
+
+    @callback
+    def attach(self, device: Device, data: dict[str, Any] | None):
+        """Restore a device from a snapshot and save it whenever it changes."""
+        self.device = device
+        if data:
+            device.restore(data)
+        for attr in (*DeviceState.__slots__, "schedule"):
+            device.register_update(attr, self.schedule_save)
+
+    @callback
+    def schedule_save(self):
+        """Save the snapshot once changes settled."""
+        if self.device:
+            self.store.async_delay_save(self.device.snapshot, SAVE_DELAY)
+
+    async def async_save(self):
+        """Save the snapshot right away."""
+        if self.device:
+            await self.store.async_save(self.device.snapshot())
+
+    async def async_remove(self):
+        """Delete the stored snapshot."""
+        await self.store.async_remove()
@@ -30,6 +30,10 @@ class FluvalSwitch(FluvalEntity, SwitchEntity):
 
     async def async_turn_off(self, **kwargs):
         """Turn the entity off."""
+        self.check_writes()
+        self.device.set_value(self.attr, False)
 
     async def async_turn_on(self, **kwargs):
         """Turn the entity on."""
+        self.check_writes()
+        self.device.set_value(self.attr, True)
@@ -0,0 +1,112 @@
+"""Run Fluval devices without Home Assistant and control them over HTTP/JSON.
+
+The devices are listed in a JSON config file:
+
+    {
+      "slots": 3,
+      "devices": [
+        {"mac": "AA:BB:CC:DD:EE:FF", "name": "Rack A1", "adapter": "hci0",
+         "mode": "on_demand", "pipeline": true, "writes": true}
+      ]
+    }
+
+Devices only accept scenes, transitions and schedules with "writes", the
+layouts of these commands are not verified against the Fluval app yet.
+
+    python daemon/fluvald.py fleet.json --port 8787
+    python daemon/fluvald.py fleet.json --adapter hci1 --socket /run/fluvald.sock
+
+With --spawn one process is started per adapter of the config, listening on
+consecutive ports or on sockets suffixed with the adapter name.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from pathlib import Path
+import signal
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from standalone import core  # noqa: E402
+
+_LOGGER = logging.getLogger("fluvald")
+
+
+async def run(config: dict, args: argparse.Namespace):
+    """Serve the devices of one shard until interrupted."""
+    daemon = core("daemon")
+    fleet = daemon.Fleet(config, args.adapter)
+    server = await daemon.Api(fleet).serve(args.host, args.port, args.socket)
+    await fleet.start()
+    _LOGGER.info(
+        "Serving %d devices of %s on %s",
+        len(fleet.devices),
+        args.adapter or "all adapters",
+        args.socket or f"{args.host}:{args.port}",
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    server.close()
+    await server.wait_closed()
+    await fleet.stop()
+
+
+async def spawn(config: dict, args: argparse.Namespace):
+    """Start one process per adapter and wait for all of them."""
+    adapters = {device.get("adapter") for device in config.get("devices", [])}
+    if not adapters or None in adapters:
+        raise SystemExit("--spawn needs an adapter for every device")
+
+    processes = []
+    for index, adapter in enumerate(sorted(adapters)):
+        command = [sys.executable, __file__, args.config, "--adapter", adapter]
+        if args.socket:
+            command += ["--socket", f"{args.socket}.{adapter}"]
+        else:
+            command += ["--host", args.host, "--port", str(args.port + index)]
+        if args.verbose:
+            command.append("--verbose")
+        processes.append(await asyncio.create_subprocess_exec(*command))
+
+    try:
+        await asyncio.gather(*(process.wait() for process in processes))
+    finally:
+        for process in processes:
+            if process.returncode is None:
+                process.terminate()
+
+
+def main() -> None:
+    """Parse the arguments and run the daemon."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("config", help="JSON file listing the devices")
+    parser.add_argument("--adapter", help="only run the devices of this adapter")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--socket", help="listen on this Unix socket instead")
+    parser.add_argument(
+        "--spawn", action="store_true", help="run one process per adapter"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(process)d %(name)s %(levelname)s %(message)s",
+    )
+    with open(args.config, encoding="utf-8") as file:
+        config = json.load(file)
+
+    asyncio.run(spawn(config, args) if args.spawn else run(config, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Load the integration core without Home Assistant.
+
+Used by the benchmarks and the daemon, which run outside of Home Assistant.
+"""
+
+import importlib
+import importlib.util
+from pathlib import Path
+import sys
+
+CORE = Path(__file__).parent / "custom_components" / "fluvalble" / "core"
+PACKAGE = "fluvalble_core"
+
+
+def core(module: str):
+    """Import a module of the integration core without Home Assistant.
+
+    The core package is loaded under its own name so that neither the
+    integration package nor its platform modules (which shadow stdlib names
+    like select) end up on sys.path.
+    """
+    if PACKAGE not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            PACKAGE, CORE / "__init__.py", submodule_search_locations=[str(CORE)]
+        )
+        package = importlib.util.module_from_spec(spec)
+        sys.modules[PACKAGE] = package
+        spec.loader.exec_module(package)
+    return importlib.import_module(f"{PACKAGE}.{module}")
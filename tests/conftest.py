@@ -0,0 +1,6 @@
+"""Make the standalone core loader importable from the tests."""
+
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
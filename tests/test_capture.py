@@ -0,0 +1,74 @@
+"""Tests of the packet capture file format and recording."""
+
+import asyncio
+
+import pytest
+
+from standalone import core
+
+capture = core("capture")
+device_module = core("device")
+policy = core("policy")
+simulator = core("simulator")
+
+
+def test_parse_round_trip(tmp_path):
+    recorded = capture.Capture()
+    recorded.record(capture.KIND_CHUNK, bytearray(b"\x01\x02"))
+    recorded.record(capture.KIND_FRAME, memoryview(b"\x68\x05"))
+    recorded.record(capture.KIND_WRITE, b"")
+    path = tmp_path / "fluval.cap"
+    recorded.save(path)
+
+    records = capture.load(path)
+    assert [(kind, data) for _, kind, data in records] == [
+        (capture.KIND_CHUNK, b"\x01\x02"),
+        (capture.KIND_FRAME, b"\x68\x05"),
+        (capture.KIND_WRITE, b""),
+    ]
+    timestamps = [timestamp for timestamp, _, _ in records]
+    assert timestamps == sorted(timestamps)
+
+
+def test_ring_buffer_keeps_latest():
+    recorded = capture.Capture(records=2)
+    for i in range(5):
+        recorded.record(capture.KIND_CHUNK, bytes([i]))
+    assert len(recorded) == 2
+    assert [data for _, _, data in capture.parse(recorded.dump())] == [b"\x03", b"\x04"]
+
+
+def test_invalid_captures():
+    dump = capture.Capture().dump()
+    with pytest.raises(ValueError):
+        list(capture.parse(dump[:-1]))
+    with pytest.raises(ValueError):
+        list(capture.parse(b"NOTCAP" + dump[6:]))
+
+    recorded = capture.Capture()
+    recorded.record(capture.KIND_CHUNK, b"\x01\x02\x03")
+    with pytest.raises(ValueError):
+        list(capture.parse(recorded.dump()[:-1]))
+
+
+def test_device_records_traffic():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        device = device_module.Device(
+            "test",
+            sim.device,
+            sim.advertisement(),
+            policy.ConnectionPolicy(policy.MODE_ALWAYS),
+            connector=sim.establish_connection,
+            writes=True,
+        )
+        device.start_capture()
+        await device.set_value("channel_1", 100)
+        recorded = device.stop_capture()
+        await device.close()
+
+        kinds = {kind for _, kind, _ in capture.parse(recorded.dump())}
+        assert kinds == {capture.KIND_CHUNK, capture.KIND_FRAME, capture.KIND_WRITE}
+        assert device.stop_capture() is None
+
+    asyncio.run(run())
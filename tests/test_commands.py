@@ -0,0 +1,141 @@
+"""Tests of the command queue and the pipeline window."""
+
+import asyncio
+
+import pytest
+
+from standalone import core
+
+commands = core("commands")
+protocol = core("protocol")
+
+
+def test_same_key_coalesces():
+    async def run():
+        queue = commands.CommandQueue(ttl=10)
+        first = queue.put(b"first", "state")
+        second = queue.put(b"second", "state")
+        assert first is second
+        assert len(queue) == 1
+        assert queue.get_nowait().data == b"second"
+        assert queue.get_nowait() is None
+
+    asyncio.run(run())
+
+
+def test_higher_priority_first():
+    async def run():
+        queue = commands.CommandQueue(ttl=10)
+        queue.put(b"low", "low", commands.PRIORITY_LOW)
+        queue.put(b"normal", "normal")
+        queue.put(b"raised", "low", commands.PRIORITY_HIGH)
+        assert len(queue) == 2
+        assert queue.get_nowait().data == b"raised"
+        assert queue.get_nowait().data == b"normal"
+        assert queue.get_nowait() is None
+
+    asyncio.run(run())
+
+
+def test_expired_commands_fail_without_consumer():
+    async def run():
+        queue = commands.CommandQueue(ttl=0.01)
+        future = queue.put(b"data", "state")
+        await asyncio.sleep(0.02)
+        assert len(queue) == 0
+        with pytest.raises(TimeoutError):
+            await future
+        # The key is free again for a new command
+        assert queue.put(b"data", "state") is not future
+
+    asyncio.run(run())
+
+
+def test_wait():
+    async def run():
+        queue = commands.CommandQueue(ttl=10)
+        assert not await queue.wait(0.01)
+        queue.put(b"data")
+        assert await queue.wait(0.01)
+        queue.get_nowait()
+        asyncio.get_running_loop().call_later(0.01, queue.wake)
+        assert await queue.wait(1)
+
+    asyncio.run(run())
+
+
+def test_clear_fails_waiting_commands():
+    async def run():
+        queue = commands.CommandQueue(ttl=10)
+        failed = queue.put(b"failed", "state")
+        queue.clear(ConnectionError("gone"))
+        cancelled = queue.put(b"cancelled", "state")
+        assert cancelled is not failed
+        queue.clear()
+        with pytest.raises(ConnectionError):
+            await failed
+        assert cancelled.cancelled()
+        assert len(queue) == 0
+
+    asyncio.run(run())
+
+
+def set_state(channel: int) -> bytearray:
+    return protocol.STATE.pack(protocol.CMD_SET_STATE, 0, 1, channel, 0, 0, 0, 0)
+
+
+def report(channel: int) -> bytearray:
+    return protocol.STATE.pack(protocol.CMD_STATE, 0, 1, channel, 0, 0, 0, 0)
+
+
+def window_command(window, data: bytes, key: str | None = None):
+    future = asyncio.get_running_loop().create_future()
+    command = commands.Command(data, key, commands.PRIORITY_NORMAL, future, 0)
+    window.add(command)
+    return command
+
+
+def test_ack_matches_oldest_set_state():
+    async def run():
+        window = commands.Window(size=2, timeout=10, retries=1)
+        command = window_command(window, set_state(500))
+        assert window.ack(report(100)) is None
+        assert window.ack(report(500)) is command
+        assert command.future.done() and not len(window)
+
+    asyncio.run(run())
+
+
+def test_any_report_acks_other_commands():
+    async def run():
+        window = commands.Window(size=2, timeout=10, retries=1)
+        command = window_command(
+            window, bytes([protocol.FRAME_MARKER, protocol.CMD_STATE])
+        )
+        assert window.ack(report(100)) is command
+
+    asyncio.run(run())
+
+
+def test_unacked_commands_are_resent_then_fail():
+    async def run():
+        window = commands.Window(size=2, timeout=0, retries=1)
+        command = window_command(window, set_state(500))
+        assert window.expired() == [command]
+        window.add(command)
+        assert window.expired() == []
+        with pytest.raises(TimeoutError):
+            await command.future
+
+    asyncio.run(run())
+
+
+def test_superseded_commands_are_not_resent():
+    async def run():
+        window = commands.Window(size=2, timeout=0, retries=1)
+        old = window_command(window, set_state(100), "state")
+        new = window_command(window, set_state(200), "state")
+        assert window.expired() == [new]
+        assert old.future.done() and old.future.exception() is None
+
+    asyncio.run(run())
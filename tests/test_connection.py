@@ -0,0 +1,79 @@
+"""Tests of the connection slots shared per adapter."""
+
+import asyncio
+
+import pytest
+
+from standalone import core
+
+connection = core("connection")
+
+
+async def pending(coro) -> asyncio.Task:
+    """Start acquiring in a task and let it queue up."""
+    task = asyncio.ensure_future(coro)
+    await asyncio.sleep(0)
+    return task
+
+
+def test_grant_in_order_up_to_limit():
+    async def run():
+        manager = connection.ConnectionManager(slots=1)
+        slot = await manager.acquire("a", "hci0")
+        assert await manager.acquire("a", "hci0") is slot
+        second = await pending(manager.acquire("b", "hci0"))
+        third = await pending(manager.acquire("c", "hci0"))
+        # Other adapters have their own slots
+        await manager.acquire("d", "hci1")
+        assert manager.queue_depth("hci0") == 2
+
+        manager.release("a")
+        assert (await second).owner == "b" and not third.done()
+        manager.release("b")
+        assert (await third).owner == "c"
+        assert manager.stats()["hci0"] == {"limit": 1, "connected": 1, "waiting": 0}
+
+    asyncio.run(run())
+
+
+def test_set_limit_wakes_waiters():
+    async def run():
+        manager = connection.ConnectionManager(slots=1)
+        await manager.acquire("a", "proxy")
+        waiting = await pending(manager.acquire("b", "proxy"))
+        manager.set_limit("proxy", 2)
+        assert (await waiting).owner == "b"
+        assert manager.limit("proxy") == 2 and manager.limit("hci0") == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def run():
+        manager = connection.ConnectionManager(slots=1)
+        await manager.acquire("a", "hci0")
+        cancelled = await pending(manager.acquire("b", "hci0"))
+        waiting = await pending(manager.acquire("c", "hci0"))
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert manager.queue_depth() == 1
+        manager.release("a")
+        assert (await waiting).owner == "c"
+
+    asyncio.run(run())
+
+
+def test_idle_holder_is_evicted_for_waiter():
+    async def run():
+        manager = connection.ConnectionManager(slots=2, idle_time=0.01)
+        # Holders without a release callback are never asked to disconnect
+        await manager.acquire("pinned", "hci0")
+        await manager.acquire("idle", "hci0", release=lambda: manager.release("idle"))
+        await asyncio.sleep(0.02)
+        slot = await asyncio.wait_for(manager.acquire("waiter", "hci0"), 1)
+        assert slot.owner == "waiter"
+        assert manager.evictions == 1
+        assert manager.stats()["hci0"]["connected"] == 2
+
+    asyncio.run(run())
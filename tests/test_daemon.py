@@ -0,0 +1,65 @@
+"""Tests of the routes of the standalone daemon."""
+
+import asyncio
+
+import pytest
+
+from standalone import core
+
+daemon = core("daemon")
+simulator = core("simulator")
+
+MAC = "00:00:00:00:00:01"
+
+
+def api() -> daemon.Api:
+    return daemon.Api(daemon.Fleet({"devices": [{"mac": MAC}]}))
+
+
+def test_device_not_seen_yet_is_unavailable():
+    async def run():
+        server = api()
+        with pytest.raises(daemon.ApiError) as error:
+            await server.route(
+                "POST", ["devices", MAC, "scene"], {}, {"mode": "manual"}
+            )
+        assert error.value.status == 503
+        # Reading the last known state does not need the device
+        described = await server.route("GET", ["devices", MAC], {}, {})
+        assert described["available"] is False
+
+        results = await server.route(
+            "POST", ["scene"], {}, {"devices": [MAC], "values": {"mode": "manual"}}
+        )
+        assert results[MAC]["success"] is False
+        await server.fleet.stop()
+
+    asyncio.run(run())
+
+
+def test_schedule_slots_are_sorted_by_time():
+    async def run():
+        server = api()
+        device = server.fleet.get(MAC)
+        device.update_ble(simulator.SimulatedFluval().advertisement())
+        uploaded = []
+
+        async def upload_schedule(slots):
+            uploaded.extend(slots)
+            return len(slots)
+
+        device.upload_schedule = upload_schedule
+        slots = [
+            {"time": "20:00", "channels": [0] * 5},
+            {"time": "08:30", "channels": [1] * 5},
+            {"time": "08:00", "channels": [2] * 5},
+        ]
+        await server.route("POST", ["devices", MAC, "schedule"], {}, {"slots": slots})
+        assert [(slot.hour, slot.minute) for slot in uploaded] == [
+            (8, 0),
+            (8, 30),
+            (20, 0),
+        ]
+        await server.fleet.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,134 @@
+"""Tests of optimistic writes against a simulated Fluval."""
+
+import asyncio
+
+import pytest
+
+from standalone import core
+
+client_module = core("client")
+device_module = core("device")
+policy = core("policy")
+protocol = core("protocol")
+simulator = core("simulator")
+
+
+async def connected_device(sim) -> device_module.Device:
+    device = device_module.Device(
+        "test",
+        sim.device,
+        sim.advertisement(),
+        policy.ConnectionPolicy(policy.MODE_ALWAYS),
+        connector=sim.establish_connection,
+        writes=True,
+    )
+    await device.client.connect()
+    return device
+
+
+async def settle():
+    """Let the state report answering the last write arrive."""
+    await asyncio.sleep(0.05)
+
+
+def test_write_is_confirmed_by_report():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        sim.channels = [100, 200, 300, 400, 500]
+        device = await connected_device(sim)
+        await settle()
+
+        await device.set_value("channel_1", 1000)
+        assert device.state.channel_1 == 1000
+        await settle()
+        assert not device.pending
+        assert sim.channels == [1000, 200, 300, 400, 500]
+        assert sim.led_on_off == 1
+        await device.close()
+
+    asyncio.run(run())
+
+
+def test_coalesced_writes_keep_every_value():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        device = await connected_device(sim)
+        await settle()
+
+        await asyncio.gather(
+            device.set_value("channel_1", 10), device.set_value("channel_2", 20)
+        )
+        await settle()
+        assert sim.channels[:2] == [10, 20]
+        assert (device.state.channel_1, device.state.channel_2) == (10, 20)
+        await device.close()
+
+    asyncio.run(run())
+
+
+def test_unconfirmed_write_rolls_back(monkeypatch):
+    monkeypatch.setattr(device_module, "CONFIRM_TIMEOUT", 0.05)
+
+    async def run():
+        sim = simulator.SimulatedFluval()
+        # The device answers but ignores the new values
+        sim.handlers[protocol.CMD_SET_STATE] = lambda payload: None
+        device = await connected_device(sim)
+        await settle()
+
+        await device.set_value("channel_1", 1000)
+        assert device.state.channel_1 == 1000
+        await asyncio.sleep(0.1)
+        assert device.state.channel_1 == 0
+        assert not device.pending
+        assert device.metrics.counters["rollbacks"] == 1
+        await device.close()
+
+    asyncio.run(run())
+
+
+def test_writes_are_refused_unless_enabled():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        device = device_module.Device(
+            "test",
+            sim.device,
+            sim.advertisement(),
+            policy.ConnectionPolicy(policy.MODE_ALWAYS),
+            connector=sim.establish_connection,
+        )
+        await device.client.connect()
+        with pytest.raises(device_module.WritesDisabledError):
+            device.set_value("channel_1", 1000)
+        with pytest.raises(device_module.WritesDisabledError):
+            await device.upload_schedule([])
+        assert device.state.channel_1 == 0
+        assert not device.pending
+        await settle()
+        assert sim.writes == 1
+        await device.close()
+
+    asyncio.run(run())
+
+
+def test_lost_link_shows_disconnected_until_reconnected():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        device = device_module.Device(
+            "test",
+            sim.device,
+            sim.advertisement(),
+            policy.ConnectionPolicy(policy.MODE_ALWAYS, backoff_min=0.05),
+            connector=sim.establish_connection,
+        )
+        await device.client.connect()
+        sim.client._drop()
+        assert device.client.state == client_module.STATE_LOST
+        assert not device.connected
+        assert not device.client.ready.is_set()
+
+        await asyncio.wait_for(device.client.connect(), 1)
+        assert device.connected
+        await device.close()
+
+    asyncio.run(run())
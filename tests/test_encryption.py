@@ -0,0 +1,59 @@
+"""Tests of the packet codec against the original byte by byte loops."""
+
+from standalone import core
+
+encryption = core("encryption")
+
+
+def loop_encrypt(source: bytes) -> bytearray:
+    secret = (len(source) + 1) ^ 0x54
+    encoded = bytearray([0x54, secret, 0x5A])
+    for b in source:
+        encoded.append(b ^ 0xE)
+    return encoded
+
+
+def loop_decrypt(source: bytes) -> bytearray:
+    key = source[0] ^ source[2]
+    return bytearray(b ^ key for b in source[3:])
+
+
+def test_encrypt():
+    for length in (0, 1, 14, 17):
+        source = bytes(range(length))
+        assert encryption.encrypt(source) == loop_encrypt(source)
+
+
+def test_decrypt_any_key():
+    # Packets of the Fluval may use other keys than the ones we send
+    packet = bytes([0x12, 0x34, 0x56]) + bytes(range(17))
+    for buffer in (packet, bytearray(packet), memoryview(packet)):
+        assert encryption.decrypt(buffer) == loop_decrypt(packet)
+
+
+def test_decrypt_into_offset():
+    source = bytes(range(17))
+    packet = encryption.encrypt(source)
+    for buffer in (packet, bytes(packet), memoryview(bytes(packet))):
+        target = bytearray(40)
+        assert encryption.decrypt_into(buffer, target, 3) == len(source)
+        assert target == bytes(3) + source + bytes(20)
+
+
+def test_payload_length():
+    assert encryption.payload_length(encryption.encrypt(bytes(17))) == 17
+
+
+def test_bulk_apis():
+    sources = [bytes([i]) * i for i in range(1, 10)]
+    packets = encryption.encrypt_many(sources)
+    assert packets == [loop_encrypt(source) for source in sources]
+    assert encryption.decrypt_many(packets) == sources
+
+
+def test_crc():
+    packet = b"\x68\x05\x01"
+    assert encryption.crc(b"") == 0
+    assert encryption.crc(packet) == 0x68 ^ 0x05 ^ 0x01
+    assert encryption.add_crc(packet) == packet + bytes([0x68 ^ 0x05 ^ 0x01])
+    assert encryption.crc(encryption.add_crc(packet)) == 0
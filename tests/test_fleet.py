@@ -0,0 +1,55 @@
+"""Tests of the bounded fan-out of group operations."""
+
+import asyncio
+from types import SimpleNamespace
+
+from standalone import core
+
+fleet = core("fleet")
+
+
+def devices(count: int) -> list[SimpleNamespace]:
+    return [
+        SimpleNamespace(name=f"tank {i}", mac=f"00:00:00:00:00:{i:02X}")
+        for i in range(count)
+    ]
+
+
+def test_concurrency_is_bounded():
+    async def run():
+        running = peak = 0
+
+        async def operation(device):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return device.name
+
+        results = await fleet.fan_out(devices(10), operation, concurrency=3)
+        assert peak == 3
+        assert [result["result"] for result in results.values()] == [
+            f"tank {i}" for i in range(10)
+        ]
+        assert all(result["success"] for result in results.values())
+
+    asyncio.run(run())
+
+
+def test_failures_and_timeouts_do_not_stop_others():
+    async def run():
+        async def operation(device):
+            if device.name == "tank 0":
+                raise ValueError("bad value")
+            if device.name == "tank 1":
+                await asyncio.sleep(1)
+            return True
+
+        results = await fleet.fan_out(devices(3), operation, timeout=0.05)
+        failed, timed_out, done = results.values()
+        assert (failed["success"], failed["error"]) == (False, "bad value")
+        assert (timed_out["success"], timed_out["error"]) == (False, "TimeoutError")
+        assert done["success"] and done["result"] is True
+
+    asyncio.run(run())
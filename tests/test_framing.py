@@ -0,0 +1,105 @@
+"""Tests of the reassembly of notification chunks into frames."""
+
+from standalone import core
+
+encryption = core("encryption")
+framing = core("framing")
+protocol = core("protocol")
+schedule = core("schedule")
+simulator = core("simulator")
+
+# Message type of the tests with a registered length
+FIXED = 0x42
+
+
+def state_report(channel: int, size: int = simulator.REPORT_SIZE) -> bytearray:
+    frame = protocol.STATE.pack(protocol.CMD_STATE, 0, 1, channel, 0, 0, 0, 0)
+    frame.extend(bytes(size - len(frame)))
+    return frame
+
+
+def fixed_frame(value: int) -> bytes:
+    return bytes([protocol.FRAME_MARKER, FIXED]) + bytes([value]) * 32
+
+
+def chunks(frame: bytes) -> list[bytearray]:
+    return [
+        encryption.encrypt(frame[i : i + framing.CHUNK_SIZE])
+        for i in range(0, len(frame), framing.CHUNK_SIZE)
+    ]
+
+
+def assembler() -> tuple[framing.FrameAssembler, list[bytes]]:
+    received = []
+    framer = framing.FrameAssembler(
+        lambda view: received.append(bytes(view)), protocol.FRAME_LENGTHS
+    )
+    framer.register(FIXED, len(fixed_frame(0)))
+    return framer, received
+
+
+def test_state_reports_of_any_length_end_with_short_chunk():
+    framer, received = assembler()
+    for size in (34, 36, 20, simulator.REPORT_SIZE):
+        frame = state_report(100, size)
+        for chunk in chunks(frame):
+            framer.feed(chunk)
+        if size % framing.CHUNK_SIZE == 0:
+            # Frames filling whole chunks end with an empty chunk
+            framer.feed(encryption.encrypt(b""))
+        assert received[-1] == frame
+    assert (framer.frames, framer.dropped) == (4, 0)
+
+
+def test_registered_length_completes_frame():
+    framer, received = assembler()
+    # Fills two full chunks, no short chunk ends it
+    for chunk in chunks(fixed_frame(1)):
+        framer.feed(chunk)
+    assert received == [fixed_frame(1)]
+
+
+def test_short_frame_of_registered_type_is_kept():
+    framer, received = assembler()
+    frame = fixed_frame(1)[:20]
+    for chunk in chunks(frame):
+        framer.feed(chunk)
+    assert received == [frame]
+    assert framer.dropped == 0
+
+
+def test_schedule_slot():
+    framer, received = assembler()
+    frame = schedule.encode_slot(2, schedule.EMPTY_SLOT)
+    framer.feed(encryption.encrypt(frame))
+    assert received == [frame]
+
+
+def test_lost_last_chunk_resyncs_on_next_frame():
+    framer, received = assembler()
+    for chunk in chunks(fixed_frame(1))[:-1]:
+        framer.feed(chunk)
+    for chunk in chunks(fixed_frame(2)):
+        framer.feed(chunk)
+    assert received == [fixed_frame(2)]
+    assert framer.dropped == 1
+
+
+def test_tail_without_start_is_dropped():
+    framer, received = assembler()
+    for chunk in chunks(state_report(100))[1:]:
+        framer.feed(chunk)
+    for chunk in chunks(state_report(200)):
+        framer.feed(chunk)
+    assert received == [state_report(200)]
+    assert framer.dropped == 2
+
+
+def test_corrupt_chunk_drops_frame():
+    framer, received = assembler()
+    first, second, third = chunks(state_report(100))
+    framer.feed(first)
+    framer.feed(second[:-1])
+    framer.feed(third)
+    assert received == []
+    assert framer.dropped == 2
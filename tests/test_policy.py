@@ -0,0 +1,105 @@
+"""Tests of the circuit breaker, standalone and driving a simulated client."""
+
+import asyncio
+
+from bleak.exc import BleakError
+import pytest
+
+from standalone import core
+
+client_module = core("client")
+connection = core("connection")
+policy = core("policy")
+protocol = core("protocol")
+simulator = core("simulator")
+
+
+def test_breaker_trips_at_threshold():
+    breaker = policy.CircuitBreaker(threshold=2, reset=60)
+    assert not breaker.failure()
+    assert breaker.allow()
+    assert breaker.failure()
+    assert breaker.tripped and breaker.trips == 1
+    assert not breaker.allow()
+    assert 59 < breaker.remaining() <= 60
+    # Failed probes keep it open without counting another trip
+    assert not breaker.failure()
+    assert breaker.trips == 1
+    assert breaker.success()
+    assert breaker.allow() and not breaker.tripped
+
+
+def test_breaker_without_threshold_never_trips():
+    breaker = policy.CircuitBreaker(threshold=0, reset=60)
+    for _ in range(10):
+        assert not breaker.failure()
+    assert breaker.allow()
+
+
+def test_breaker_fails_queued_commands():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        attempts = 0
+
+        async def unreachable(*args, **kwargs):
+            nonlocal attempts
+            attempts += 1
+            raise BleakError("Device unreachable")
+
+        trips = []
+        client = client_module.Client(
+            sim.device,
+            manager=connection.ConnectionManager(),
+            policy=policy.ConnectionPolicy(
+                policy.MODE_ON_DEMAND,
+                backoff_min=0.01,
+                backoff_max=0.01,
+                breaker_threshold=2,
+                breaker_reset=60,
+            ),
+            connector=unreachable,
+            breaker_callback=lambda: trips.append(client.breaker.tripped),
+        )
+        packet = bytes([protocol.FRAME_MARKER, protocol.CMD_STATE])
+        with pytest.raises(client_module.CircuitOpenError):
+            await asyncio.wait_for(client.send(packet), 5)
+        assert (attempts, trips) == (2, [True])
+
+        # While open, commands fail right away without connecting
+        with pytest.raises(client_module.CircuitOpenError):
+            await asyncio.wait_for(client.send(packet), 0.1)
+        assert attempts == 2
+
+        # Stopping does not wait for the breaker to reset
+        async with asyncio.timeout(1):
+            await client.stop()
+        assert client.ping_task is None
+
+    asyncio.run(run())
+
+
+def test_stop_cuts_backoff_short():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        attempts = 0
+
+        async def unreachable(*args, **kwargs):
+            nonlocal attempts
+            attempts += 1
+            raise BleakError("Device unreachable")
+
+        client = client_module.Client(
+            sim.device,
+            manager=connection.ConnectionManager(),
+            policy=policy.ConnectionPolicy(
+                policy.MODE_ALWAYS, backoff_min=300, breaker_threshold=0
+            ),
+            connector=unreachable,
+        )
+        client.start()
+        await asyncio.sleep(0.01)
+        async with asyncio.timeout(1):
+            await client.stop()
+        assert attempts == 1
+
+    asyncio.run(run())
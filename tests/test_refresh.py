@@ -0,0 +1,61 @@
+"""Tests of on demand state refreshes."""
+
+import asyncio
+
+from standalone import core
+
+device_module = core("device")
+policy = core("policy")
+simulator = core("simulator")
+
+
+def on_demand_device(sim) -> device_module.Device:
+    return device_module.Device(
+        "test",
+        sim.device,
+        sim.advertisement(),
+        policy.ConnectionPolicy(policy.MODE_ON_DEMAND),
+        connector=sim.establish_connection,
+    )
+
+
+def test_refresh_by_connecting_needs_only_the_handshake():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        sim.channels = [1, 2, 3, 4, 5]
+        device = on_demand_device(sim)
+        state = await device.refresh()
+        assert state.channel_5 == 5
+        await asyncio.sleep(0.05)
+        assert sim.writes == 1
+        await device.close()
+
+    asyncio.run(run())
+
+
+def test_refresh_of_open_link_writes_state_request():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        device = on_demand_device(sim)
+        await device.refresh()
+        # Changed on the device without a report
+        sim.channels = [5, 4, 3, 2, 1]
+        states = await asyncio.gather(device.refresh(), device.refresh())
+        assert [state.channel_1 for state in states] == [5, 5]
+        assert sim.writes == 2
+        await device.close()
+
+    asyncio.run(run())
+
+
+def test_recent_state_is_not_requested():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        device = on_demand_device(sim)
+        await device.refresh()
+        sim.channels = [5, 4, 3, 2, 1]
+        assert (await device.refresh(max_age=60)).channel_1 == 0
+        assert sim.writes == 1
+        await device.close()
+
+    asyncio.run(run())
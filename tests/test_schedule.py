@@ -0,0 +1,65 @@
+"""Tests of the cached professional mode schedule."""
+
+import asyncio
+
+import pytest
+
+from standalone import core
+
+device_module = core("device")
+policy = core("policy")
+schedule = core("schedule")
+simulator = core("simulator")
+
+MORNING = schedule.ScheduleSlot(8, 30, (100, 200, 300, 400, 500))
+EVENING = schedule.ScheduleSlot(20, 0, (0, 0, 0, 0, 50))
+
+
+def test_diff_writes_changed_and_cleared_slots():
+    cached = schedule.Schedule([MORNING, EVENING] + [schedule.EMPTY_SLOT] * 6)
+    assert cached.diff([MORNING, EVENING]) == []
+    assert cached.diff([MORNING]) == [(1, schedule.EMPTY_SLOT)]
+    assert cached.diff([EVENING, EVENING]) == [(0, EVENING)]
+
+
+def test_diff_of_unknown_slots_writes_everything():
+    assert len(schedule.Schedule().diff([MORNING])) == schedule.SLOTS
+
+
+def test_diff_rejects_long_programs():
+    with pytest.raises(ValueError):
+        schedule.Schedule().diff([MORNING] * (schedule.SLOTS + 1))
+
+
+def test_slot_round_trip():
+    frame = schedule.encode_slot(3, MORNING)
+    assert schedule.decode_slot(frame) == (3, MORNING)
+
+
+def test_dump_load():
+    cached = schedule.Schedule([MORNING, None, EVENING])
+    loaded = schedule.Schedule.load(cached.dump())
+    assert loaded.slots == cached.slots
+    assert not loaded.complete
+    assert [slot["time"] for slot in loaded.as_list()] == ["08:30", "20:00"]
+
+
+def test_upload_writes_only_changes():
+    async def run():
+        sim = simulator.SimulatedFluval()
+        device = device_module.Device(
+            "test",
+            sim.device,
+            sim.advertisement(),
+            policy.ConnectionPolicy(policy.MODE_ALWAYS),
+            connector=sim.establish_connection,
+            writes=True,
+        )
+        assert await device.upload_schedule([MORNING, EVENING]) == 2
+        assert sim.schedule[:3] == [MORNING, EVENING, schedule.EMPTY_SLOT]
+        assert await device.upload_schedule([MORNING, EVENING]) == 0
+        assert await device.upload_schedule([MORNING]) == 1
+        assert sim.schedule[1] == schedule.EMPTY_SLOT
+        await device.close()
+
+    asyncio.run(run())
@@ -0,0 +1,83 @@
+"""Tests of the snapshots restoring the last known state of a device."""
+
+import asyncio
+
+from standalone import core
+
+device_module = core("device")
+policy = core("policy")
+protocol = core("protocol")
+schedule = core("schedule")
+simulator = core("simulator")
+
+
+def offline_device() -> device_module.Device:
+    sim = simulator.SimulatedFluval()
+    return device_module.Device(
+        "test",
+        sim.device,
+        None,
+        policy.ConnectionPolicy(policy.MODE_ON_DEMAND),
+        connector=sim.establish_connection,
+    )
+
+
+def saved_device() -> dict:
+    device = offline_device()
+    device.decode_update_packet(
+        protocol.STATE.pack(protocol.CMD_STATE, 0, 1, 10, 20, 30, 40, 50)
+    )
+    device.schedule = schedule.Schedule([schedule.EMPTY_SLOT] * schedule.SLOTS)
+    return device.snapshot()
+
+
+def test_snapshot_round_trip():
+    async def run():
+        snapshot = saved_device()
+        device = offline_device()
+        device.restore(snapshot)
+        assert device.restored is not None
+        assert device.state.as_dict() == {
+            "mode": "manual",
+            "led_on_off": True,
+            "channel_1": 10,
+            "channel_2": 20,
+            "channel_3": 30,
+            "channel_4": 40,
+            "channel_5": 50,
+        }
+        assert device.confirmed["channel_5"] == 50
+        assert device.schedule.complete and device.schedule_complete.is_set()
+        await device.close()
+
+    asyncio.run(run())
+
+
+def test_report_wins_over_restore():
+    async def run():
+        snapshot = saved_device()
+        device = offline_device()
+        device.decode_update_packet(
+            protocol.STATE.pack(protocol.CMD_STATE, 0, 0, 1, 2, 3, 4, 5)
+        )
+        device.restore(snapshot)
+        assert (device.state.led_on_off, device.state.channel_1) == (False, 1)
+        assert device.confirmed["channel_1"] == 1
+        await device.close()
+
+    asyncio.run(run())
+
+
+def test_invalid_snapshot_is_ignored():
+    async def run():
+        device = offline_device()
+        snapshot = saved_device()
+        device.restore({**snapshot, "saved": "yesterday"})
+        assert device.restored is None
+        assert device.state.channel_1 == 0
+
+        device.restore({**snapshot, "state": {"mode": "disco", "channel_1": 7}})
+        assert (device.state.mode, device.state.channel_1) == ("manual", 7)
+        await device.close()
+
+    asyncio.run(run())